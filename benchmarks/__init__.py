@@ -0,0 +1 @@
+"""Benchmarks of BloodConnect operations on synthetic data"""
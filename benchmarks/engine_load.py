@@ -0,0 +1,133 @@
+"""Measure matching engine throughput over HTTP under concurrent clients
+
+    python -m benchmarks.engine_load
+    python -m benchmarks.engine_load --donors 1000000 --clients 1 8 32 --batch 1 100
+
+The engine server runs in its own interpreter on a synthetic city, so client
+threads do not compete with it for the GIL. Each client keeps one connection
+open and posts batches of hospital requests to /match (or /requests with
+--submit, which also stores them and queues notifications) for a fixed time.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import generate_donors, generate_requests
+from utils.database import Database
+
+DONORS = 100_000
+CLIENTS = [1, 4, 16]
+BATCHES = [1, 50]
+SECONDS = 5.0
+# Distinct requests the clients cycle through
+REQUEST_POOL = 1000
+
+
+def seed_database(path, donors, seed):
+    db = Database(path)
+    for chunk in generate_donors(donors, seed):
+        db.insert_donors(chunk)
+
+
+def start_server(db_path):
+    """Engine server child process on a free port, and its port once it is listening"""
+    server = subprocess.Popen([sys.executable, '-m', 'utils.engine_server', '--port', '0', '--db', db_path],
+                              stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line:
+        raise RuntimeError("Engine server exited before listening")
+    return server, int(line.split('http://', 1)[1].split()[0].rsplit(':', 1)[1])
+
+
+def client(port, path, bodies, deadline, latencies, errors):
+    """Post bodies in turn until deadline, recording per-call latency in ms"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            conn.request('POST', path, bodies[i % len(bodies)], {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            latencies.append((time.perf_counter() - start) * 1000)
+            i += 1
+    finally:
+        conn.close()
+
+
+def run(port, path, requests, clients, batch, seconds):
+    """Calls/s, requests matched/s and latency percentiles for one load level"""
+    bodies = [json.dumps({'requests': requests[start:start + batch]}).encode()
+              for start in range(0, len(requests) - batch + 1, batch)]
+    latencies = [[] for _ in range(clients)]
+    errors = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=client, args=(port, path, bodies[i::clients] or bodies,
+                                                     deadline, latencies[i], errors))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    times = np.concatenate([np.asarray(l) for l in latencies])
+    return {
+        'clients': clients,
+        'batch': batch,
+        'calls_per_s': len(times) / elapsed,
+        'requests_per_s': len(times) * batch / elapsed,
+        'p50_ms': float(np.percentile(times, 50)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'p99_ms': float(np.percentile(times, 99)),
+        'errors': len(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--donors', type=int, default=DONORS)
+    parser.add_argument('--clients', type=int, nargs='+', default=CLIENTS)
+    parser.add_argument('--batch', type=int, nargs='+', default=BATCHES)
+    parser.add_argument('--seconds', type=float, default=SECONDS)
+    parser.add_argument('--submit', action='store_true', help="post to /requests instead of /match")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    fields = ['patient_name', 'blood_type', 'units_needed', 'urgency', 'hospital_name',
+              'contact', 'location', 'latitude', 'longitude']
+    requests = [{field: request[field] for field in fields}
+                for request in generate_requests(REQUEST_POOL, args.seed)]
+    path = '/requests' if args.submit else '/match'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'load.db')
+        print(f"Seeding {args.donors:,} donors...", file=sys.stderr)
+        seed_database(db_path, args.donors, args.seed)
+        server, port = start_server(db_path)
+        try:
+            print(f"{'clients':>8}{'batch':>7}{'calls/s':>10}{'requests/s':>12}"
+                  f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+            for batch in args.batch:
+                for clients in args.clients:
+                    r = run(port, path, requests, clients, batch, args.seconds)
+                    print(f"{r['clients']:>8}{r['batch']:>7}{r['calls_per_s']:>10.0f}"
+                          f"{r['requests_per_s']:>12.0f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}"
+                          f"{r['p99_ms']:>9.2f}{r['errors']:>8}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
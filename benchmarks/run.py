@@ -0,0 +1,256 @@
+"""Time BloodConnect's hot paths on synthetic cities of increasing size
+
+    python -m benchmarks.run --sizes 1000 100000 1000000 --output results.json
+    python -m benchmarks.run --compare results.json
+
+Writes and matching go through the same SharedStore and MatchingEngine the app
+uses, database included. The Streamlit script cannot be imported without
+running it, so read-only page helpers are repeated here on the snapshot they
+read. Results are written as JSON (one entry per size and operation) and can be
+compared against an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import AREAS, CITY, generate_donors, generate_notifications, generate_requests
+from components.map_view import donor_map
+from utils.database import Database
+from utils.donor_store import BLOOD_CODES, BLOOD_TYPES
+from utils.eligibility import eligible_mask
+from utils.engine import MatchingEngine
+from utils.leaderboard import area_of
+from utils.location_utils import distances_within
+from utils.notification_system import FakeGateway, NotificationDispatcher
+from utils.shared_store import SharedStore
+
+SIZES = [1_000, 100_000, 1_000_000]
+# Timed calls per operation and size
+REPEAT = 50
+# Requests and notifications generated per donor
+REQUESTS_PER_DONOR = 0.01
+NOTIFICATIONS_PER_REQUEST = 10
+# Same limit the app uses
+DONORS_PER_PAGE = 20
+# Only these fields of a result are compared between runs
+COMPARED = 'p50_ms'
+
+
+class City:
+    """The app's shared store and matching engine over a database of synthetic data"""
+
+    def __init__(self, size, seed, db_path):
+        self.seed = seed
+        self.db = Database(db_path)
+        donor_ids = []
+        for donors in generate_donors(size, seed):
+            self.db.insert_donors(donors)
+            donor_ids.extend(donor['id'] for donor in donors)
+        self.requests = generate_requests(max(int(size * REQUESTS_PER_DONOR), 10), seed)
+        self.db.insert_requests(self.requests)
+        self.db.insert_notifications(
+            generate_notifications(self.requests, donor_ids, NOTIFICATIONS_PER_REQUEST, seed))
+        self.dispatcher = NotificationDispatcher(FakeGateway())
+        self.shared = SharedStore(self.db)
+        self.engine = MatchingEngine(self.shared, self.dispatcher)
+
+    def load(self):
+        """First sync, as the app's first rerun does"""
+        self.shared.sync()
+        self.engine.refresh()
+
+    def close(self):
+        self.dispatcher.close()
+
+    # Operations, one per page helper
+    def donors_within(self, blood_type, lat, lon, radius=10):
+        return self.engine.within(blood_type, lat, lon, radius)
+
+    def request_fanout(self, request):
+        """A request stored and its nearest 10 donors notified"""
+        return self.engine.submit([dict(request, k=10)])
+
+    def register_donor(self, donor):
+        """A new donor written, then synced into the snapshot and matching pool"""
+        self.db.insert_donors([donor])
+        self.shared.sync()
+        self.engine.refresh()
+
+    def set_donor_status(self, donor_id, status):
+        self.engine.set_donor_status(donor_id, status)
+
+    def award_points(self, donor_id, points):
+        self.shared.award_points(donor_id, points)
+
+    def dashboard_metrics(self):
+        metrics = self.shared.snapshot().metrics
+        figures = (metrics.total_donors, metrics.active_donors, metrics.pending_requests,
+                   metrics.total_donations, dict(metrics.active_requests_by_urgency))
+        pie = pd.DataFrame({'Blood Type': BLOOD_TYPES,
+                            'Count': [metrics.donors_by_blood_type[b] for b in BLOOD_TYPES]})
+        return figures, pie
+
+    def leaderboard(self, row, location):
+        snapshot = self.shared.snapshot()
+        board = snapshot.leaderboards.overall
+        return (board.top(10), board.rank(row), snapshot.leaderboards.by_area[area_of(location)].top(10),
+                snapshot.donors.records([r for r, _ in board.top(10)]))
+
+    def search_donors(self, blood_type, center, radius, eligible_only=True):
+        """Find Donors filters plus the first page of records"""
+        snapshot = self.shared.snapshot()
+        store = snapshot.donors
+        rows = np.fromiter(snapshot.grid.query(center[0], center[1], radius), dtype=np.int64)
+        keep = store.column('blood_code')[rows] == BLOOD_CODES[blood_type]
+        if eligible_only:
+            keep &= eligible_mask(store.column('last_donation')[rows], time.time())
+        rows = rows[keep]
+        positions, distances = distances_within(
+            center[0], center[1], store.column('latitude')[rows], store.column('longitude')[rows], radius
+        )
+        rows = rows[positions]
+        order = np.argsort(store.column('status_code')[rows], kind='stable')
+        rows = rows[order]
+        return rows, store.records(rows[:DONORS_PER_PAGE])
+
+    def map_payload(self, rows, center, zoom):
+        fig, _ = donor_map(self.shared.snapshot().donors, rows, center, zoom)
+        return fig.to_json()
+
+
+def measure(call, arguments):
+    """Per-call wall times in milliseconds"""
+    times = []
+    for args in arguments:
+        start = time.perf_counter()
+        call(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def summarise(size, operation, times, **extra):
+    times = np.asarray(times)
+    result = {
+        'size': size,
+        'operation': operation,
+        'calls': len(times),
+        'mean_ms': float(times.mean()),
+        'p50_ms': float(np.percentile(times, 50)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'max_ms': float(times.max()),
+    }
+    result.update(extra)
+    return result
+
+
+def run_size(size, seed, repeat):
+    """Build a city of the given size and time every operation on it"""
+    rng = np.random.default_rng(seed + 3)
+    with tempfile.TemporaryDirectory() as tmp:
+        city = City(size, seed, os.path.join(tmp, 'bench.db'))
+        try:
+            start = time.perf_counter()
+            city.load()
+            results = [summarise(size, 'load', [(time.perf_counter() - start) * 1000])]
+            store = city.shared.snapshot().donors
+            areas = [AREAS[i] for i in rng.integers(len(AREAS), size=repeat)]
+            blood_types = [BLOOD_TYPES[i] for i in rng.integers(len(BLOOD_TYPES), size=repeat)]
+            rows = rng.integers(size, size=repeat).tolist()
+            requests = [city.requests[i] for i in rng.integers(len(city.requests), size=repeat)]
+
+            results.append(summarise(size, 'donors_within', measure(
+                city.donors_within, [(b, a[1], a[2]) for b, a in zip(blood_types, areas)])))
+            results.append(summarise(size, 'request_fanout', measure(
+                city.request_fanout, [(request,) for request in requests])))
+            results.append(summarise(size, 'dashboard_metrics', measure(
+                city.dashboard_metrics, [()] * repeat)))
+            results.append(summarise(size, 'leaderboard_rank', measure(
+                city.leaderboard, [(row, store.locations.values[store.column('location_code')[row]])
+                                   for row in rows])))
+            results.append(summarise(size, 'award_points', measure(
+                city.award_points, [(store.ids[row], 10) for row in rows])))
+            results.append(summarise(size, 'set_donor_status', measure(
+                city.set_donor_status, [(store.ids[row], 'Unavailable') for row in rows])))
+            results.append(summarise(size, 'register_donor', measure(
+                city.register_donor, [(donor,) for donor in next(generate_donors(repeat, seed + 1))])))
+            searches = [(b, (a[1], a[2]), 20) for b, a in zip(blood_types, areas)]
+            results.append(summarise(size, 'find_donors_filter', measure(city.search_donors, searches)))
+            # The map is drawn for every donor the filters leave, city-wide
+            everyone = np.arange(size)
+            centre = (float(np.mean([a[1] for a in AREAS])), float(np.mean([a[2] for a in AREAS])))
+            payloads = []
+            times = measure(lambda zoom: payloads.append(len(city.map_payload(everyone, centre, zoom))),
+                            [(int(zoom),) for zoom in rng.integers(9, 14, size=min(repeat, 10))])
+            results.append(summarise(size, 'map_payload', times, payload_bytes=int(np.mean(payloads))))
+        finally:
+            city.close()
+    return results
+
+
+def metadata(seed, repeat):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'city': CITY,
+        'seed': seed,
+        'repeat': repeat,
+    }
+
+
+def compare(results, baseline):
+    """Print each operation's p50 against the same size and operation in a baseline run"""
+    before = {(r['size'], r['operation']): r[COMPARED] for r in baseline['results']}
+    print(f"{'size':>9}  {'operation':<24}{'before':>10}{'after':>10}{'ratio':>8}")
+    for result in results:
+        old = before.get((result['size'], result['operation']))
+        if old is None:
+            continue
+        ratio = result[COMPARED] / old if old else float('inf')
+        print(f"{result['size']:>9}  {result['operation']:<24}{old:>10.2f}{result[COMPARED]:>10.2f}{ratio:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        print(f"Benchmarking {size:,} donors...", file=sys.stderr)
+        for result in run_size(size, args.seed, args.repeat):
+            results.append(result)
+            print(f"  {result['operation']:<24} p50 {result['p50_ms']:9.2f} ms   "
+                  f"p95 {result['p95_ms']:9.2f} ms", file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': metadata(args.seed, args.repeat), 'results': results}, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
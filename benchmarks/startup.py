@@ -0,0 +1,118 @@
+"""Check cold start and rerun times of each page against a time budget
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --pages "👤 Donor Registration" --reruns 50
+
+Cold start runs the app once in a fresh interpreter, opened straight on the
+page, and counts the time from the first script run until the page is drawn
+(Streamlit's own import is excluded, as the server has already paid it).
+Rerun time is the app's own whole-script timing, read back from the
+Performance page, so the test harness's overhead is not counted. Exits with
+status 1 if any page is over budget.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'blood_donar.py')
+PAGES = [
+    "🏠 Dashboard",
+    "👤 Donor Registration",
+    "🆘 Request Blood",
+    "🔍 Find Donors",
+    "📱 Notifications",
+    "📊 Analytics",
+    "🏆 Leaderboard",
+]
+PERFORMANCE_PAGE = "⚙️ Performance"
+# First run of a page in a new process, in milliseconds; pages without charts
+# must not load pandas or plotly
+COLD_START_BUDGET_MS = {page: 1000 for page in PAGES}
+COLD_START_BUDGET_MS.update({"🏠 Dashboard": 2500, "🔍 Find Donors": 2500, "📊 Analytics": 2500})
+# Streamlit itself imports the core of plotly, but not plotly.express
+HEAVY_MODULES = ['pandas', 'plotly.express', 'geopy', 'pyarrow']
+RERUNS = 20
+
+
+def cold_start(page):
+    """Run in a child interpreter: time the first script run of the app on a page"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP, default_timeout=120)
+    app.session_state['page'] = page
+    start = time.perf_counter()
+    app.run()
+    elapsed = (time.perf_counter() - start) * 1000
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    return {'cold_ms': elapsed, 'loaded': [m for m in HEAVY_MODULES if m in sys.modules]}
+
+
+def rerun_times(pages, reruns):
+    """p50/p95 whole-rerun time per page, from the app's own instrumentation"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP, default_timeout=120)
+    # Visit every page once so their first-run imports are not counted
+    for page in pages + [PERFORMANCE_PAGE]:
+        app.session_state['page'] = page
+        app.run()
+    next(button for button in app.button if button.label == "Reset Timings").click().run()
+    for page in pages:
+        app.session_state['page'] = page
+        for _ in range(reruns):
+            app.run()
+    app.session_state['page'] = PERFORMANCE_PAGE
+    app.run()
+    summary = app.dataframe[0].value
+    times = {}
+    for page in pages:
+        row = summary[summary['operation'] == f"rerun:{page.split(' ', 1)[1]}"].iloc[0]
+        times[page] = {'rerun_p50_ms': float(row['p50_ms']), 'rerun_p95_ms': float(row['p95_ms'])}
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', nargs='+', default=PAGES)
+    parser.add_argument('--reruns', type=int, default=RERUNS)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(cold_start(args.child)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Set before the app's modules are imported, here and in the children
+        os.environ.update(BLOODCONNECT_DB=os.path.join(tmp, 'startup.db'), BLOODCONNECT_PROFILE='1',
+                          BLOODCONNECT_METRICS_FILE=os.path.join(tmp, 'metrics.prom'))
+        results = {}
+        for page in args.pages:
+            child = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child', page],
+                                   capture_output=True, text=True, check=True)
+            results[page] = json.loads(child.stdout.strip().splitlines()[-1])
+        for page, times in rerun_times(args.pages, args.reruns).items():
+            results[page].update(times)
+
+    from utils.instrumentation import rerun_budget_ms
+
+    failed = False
+    print(f"{'page':<24}{'cold':>9}{'budget':>9}{'rerun p95':>11}{'budget':>9}  loaded")
+    for page in args.pages:
+        result = results[page]
+        budget = rerun_budget_ms(page.split(' ', 1)[1])
+        over = result['cold_ms'] > COLD_START_BUDGET_MS[page] or result['rerun_p95_ms'] > budget
+        failed |= over
+        print(f"{page:<24}{result['cold_ms']:>9.0f}{COLD_START_BUDGET_MS[page]:>9}"
+              f"{result['rerun_p95_ms']:>11.1f}{budget:>9}  "
+              f"{', '.join(result['loaded']) or '-'}{'  OVER BUDGET' if over else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
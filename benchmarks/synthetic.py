@@ -0,0 +1,153 @@
+"""Synthetic city-scale donors, requests and notifications for benchmarking
+
+Donors cluster around Hyderabad neighbourhoods with a thin uniform background
+across the city, blood types follow Indian population frequencies, and
+requests originate at hospitals. Everything is driven by one seed, so a given
+size always produces the same data.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from utils.donor_store import BLOOD_TYPES
+from utils.metrics import URGENCY_LEVELS
+
+CITY = 'Hyderabad'
+# Bounding box of the city (south, north, west, east)
+CITY_BOUNDS = (17.30, 17.55, 78.30, 78.60)
+# (area, latitude, longitude, relative population)
+AREAS = [
+    ('Banjara Hills', 17.4126, 78.4438, 3),
+    ('Jubilee Hills', 17.4239, 78.4738, 3),
+    ('Gachibowli', 17.4400, 78.3489, 4),
+    ('Madhapur', 17.4483, 78.3915, 4),
+    ('Kondapur', 17.4690, 78.3636, 3),
+    ('Kukatpally', 17.4849, 78.4138, 5),
+    ('Ameerpet', 17.4375, 78.4482, 3),
+    ('Begumpet', 17.4440, 78.4670, 2),
+    ('Secunderabad', 17.4399, 78.4983, 4),
+    ('Dilsukhnagar', 17.3687, 78.5247, 4),
+    ('LB Nagar', 17.3457, 78.5522, 3),
+    ('Mehdipatnam', 17.3959, 78.4311, 3),
+    ('Charminar', 17.3616, 78.4747, 4),
+    ('Uppal', 17.4018, 78.5602, 3),
+    ('Miyapur', 17.4968, 78.3614, 3),
+]
+HOSPITALS = [
+    ('Apollo Hospitals', 17.4156, 78.4120),
+    ('Yashoda Hospitals', 17.4435, 78.4981),
+    ('Care Hospitals', 17.4109, 78.4486),
+    ('KIMS Hospitals', 17.4420, 78.4986),
+    ('Continental Hospitals', 17.4190, 78.3422),
+    ('Osmania General Hospital', 17.3727, 78.4767),
+]
+# Approximate share of each blood type among Indian donors
+BLOOD_TYPE_SHARE = {'A+': 0.22, 'A-': 0.008, 'B+': 0.32, 'B-': 0.012,
+                    'AB+': 0.07, 'AB-': 0.005, 'O+': 0.35, 'O-': 0.015}
+URGENCY_SHARE = [0.1, 0.25, 0.4, 0.25]
+# Spread of donors around their area centre (degrees, about 1.5 km)
+AREA_SPREAD_DEG = 0.0135
+# Share of donors scattered uniformly over the city instead of near an area
+BACKGROUND_SHARE = 0.1
+AVAILABLE_SHARE = 0.8
+NEVER_DONATED_SHARE = 0.4
+
+
+def _ids(rng, count, offset=0):
+    """Reproducible UUID strings: random high bits, sequence number in the low bits"""
+    return [str(uuid.UUID(int=high << 64 | offset + i))
+            for i, high in enumerate(rng.integers(2 ** 63, size=count).tolist())]
+
+
+def _blood_types(rng, n):
+    shares = np.array([BLOOD_TYPE_SHARE[blood_type] for blood_type in BLOOD_TYPES])
+    return rng.choice(len(BLOOD_TYPES), size=n, p=shares / shares.sum())
+
+
+def generate_donors(n, seed=0, chunk_rows=50_000, now=None):
+    """Lists of donor dicts, at most chunk_rows at a time, n in total"""
+    rng = np.random.default_rng(seed)
+    now = now or datetime.now()
+    weights = np.array([area[3] for area in AREAS], dtype=float)
+    for start in range(0, n, chunk_rows):
+        count = min(chunk_rows, n - start)
+        area = rng.choice(len(AREAS), size=count, p=weights / weights.sum())
+        lat = np.array([AREAS[a][1] for a in area]) + rng.normal(0, AREA_SPREAD_DEG, count)
+        lon = np.array([AREAS[a][2] for a in area]) + rng.normal(0, AREA_SPREAD_DEG, count)
+        background = rng.random(count) < BACKGROUND_SHARE
+        south, north, west, east = CITY_BOUNDS
+        lat[background] = rng.uniform(south, north, background.sum())
+        lon[background] = rng.uniform(west, east, background.sum())
+        blood = _blood_types(rng, count)
+        available = rng.random(count) < AVAILABLE_SHARE
+        never = rng.random(count) < NEVER_DONATED_SHARE
+        days_ago = rng.integers(1, 365, count)
+        points = rng.geometric(0.01, count)
+        ids = _ids(rng, count, start)
+        yield [
+            {
+                'id': ids[i],
+                'name': f"Donor {start + i}",
+                'blood_type': BLOOD_TYPES[blood[i]],
+                'phone': f"+91-9{start + i:09d}",
+                'location': f"{AREAS[area[i]][0]}, {CITY}",
+                'latitude': float(lat[i]),
+                'longitude': float(lon[i]),
+                'status': 'Available' if available[i] else 'Unavailable',
+                'last_donation': None if never[i] else now - timedelta(days=int(days_ago[i])),
+                'points': int(points[i]),
+                'badges': [],
+            }
+            for i in range(count)
+        ]
+
+
+def generate_requests(n, seed=0, now=None):
+    """Active blood requests raised at city hospitals over the past month"""
+    rng = np.random.default_rng(seed + 1)
+    now = now or datetime.now()
+    hospital = rng.integers(len(HOSPITALS), size=n)
+    blood = _blood_types(rng, n)
+    urgency = rng.choice(len(URGENCY_LEVELS), size=n, p=URGENCY_SHARE)
+    minutes_ago = rng.integers(0, 30 * 24 * 60, n)
+    ids = _ids(rng, n)
+    return [
+        {
+            'id': ids[i],
+            'patient_name': f"Patient {i}",
+            'blood_type': BLOOD_TYPES[blood[i]],
+            'units_needed': 1,
+            'urgency': URGENCY_LEVELS[urgency[i]],
+            'hospital_name': HOSPITALS[hospital[i]][0],
+            'contact': '+91-4000000000',
+            'location': f"{HOSPITALS[hospital[i]][0]}, {CITY}",
+            'latitude': HOSPITALS[hospital[i]][1],
+            'longitude': HOSPITALS[hospital[i]][2],
+            'additional_info': '',
+            'status': 'Active',
+            'created_at': now - timedelta(minutes=int(minutes_ago[i])),
+            'responses': [],
+        }
+        for i in range(n)
+    ]
+
+
+def generate_notifications(requests, donor_ids, per_request=10, seed=0):
+    """per_request unread notifications for each request, to random donors"""
+    rng = np.random.default_rng(seed + 2)
+    picks = rng.integers(len(donor_ids), size=(len(requests), per_request))
+    ids = iter(_ids(rng, picks.size))
+    return [
+        {
+            'id': next(ids),
+            'donor_id': donor_ids[pick],
+            'message': f"🚨 URGENT: {request['patient_name']} needs {request['blood_type']} blood "
+                       f"at {request['hospital_name']}.",
+            'timestamp': request['created_at'],
+            'request_id': request['id'],
+            'status': 'unread',
+        }
+        for request, row in zip(requests, picks)
+        for pick in row.tolist()
+    ]
@@ -1,13 +1,28 @@
+import time
+# Whole-rerun timing starts before anything else runs
+rerun_started = time.perf_counter()
 import streamlit as st
-import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import time
-import json
+import os
+import tempfile
 import uuid
-from geopy.distance import geodesic
-import plotly.express as px
-import plotly.graph_objects as go
+from utils.analytics import GRANULARITIES
+from utils.database import DEFAULT_PATH, Database
+from utils.assignment import DONORS_PER_UNIT
+from utils.bulk_io import FORMATS, export_donors, import_donors
+from utils.blood_matching import is_rare_blood_type
+from utils.donor_store import BLOOD_CODES, BLOOD_TYPES
+from utils.eligibility import eligible_mask
+from utils.engine import MatchingEngine
+from utils.geocoding import load_gazetteer
+from utils.location_utils import distances_within
+from utils.instrumentation import METRICS_PATH, Recorder, rerun_budget_ms
+from utils.leaderboard import Leaderboard
+from utils.metrics import URGENCY_LEVELS
+from utils.scheduler import EscalationScheduler
+from utils.shared_store import SharedStore
+from utils.notification_system import FakeGateway, NotificationDispatcher
 
 # Configure page
 st.set_page_config(
@@ -71,21 +86,104 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'donors' not in st.session_state:
-    st.session_state.donors = []
-if 'requests' not in st.session_state:
-    st.session_state.requests = []
-if 'donations' not in st.session_state:
-    st.session_state.donations = []
+@st.cache_resource
+def get_database():
+    """SQLite store shared by every session in this process"""
+    return Database(DEFAULT_PATH)
+
+@st.cache_resource
+def get_dispatcher():
+    """Background SMS/push delivery shared by every session in this process"""
+    return NotificationDispatcher(FakeGateway())
+
+@st.cache_resource
+def get_engine():
+    """Donor matching and notification shared by every session in this process
+
+    With BLOODCONNECT_ENGINE_PORT set, hospital systems can call the same
+    engine over HTTP while the app runs.
+    """
+    engine = MatchingEngine(get_store(), get_dispatcher(), get_recorder())
+    port = os.environ.get('BLOODCONNECT_ENGINE_PORT')
+    if port:
+        from utils.engine_server import serve
+        serve(engine, port=int(port))
+    return engine
+
+@st.cache_resource
+def get_scheduler():
+    """Re-matching, escalation and expiry of active requests, off the rerun path"""
+    return EscalationScheduler(get_database(), get_dispatcher())
+
+@st.cache_resource
+def get_store():
+    """Donors, requests and notifications shared by every session in this process"""
+    return SharedStore(get_database(), get_scheduler())
+
+@st.cache_resource
+def get_gazetteer():
+    """Bundled place names for offline geocoding, with a lookup cache shared by every session"""
+    return load_gazetteer()
+
+@st.cache_resource
+def get_recorder():
+    """Hot-path timings shared by every session in this process"""
+    return Recorder()
+
+recorder = get_recorder()
+
+# Initialize session state; shared data lives in get_store(), so a session
+# keeps only its own navigation
 if 'current_user' not in st.session_state:
     st.session_state.current_user = None
-if 'notifications' not in st.session_state:
-    st.session_state.notifications = []
+if 'notification_cursors' not in st.session_state:
+    # Pagination cursors for the Notifications page, one per page visited
+    st.session_state.notification_cursors = [None]
+
+@recorder.timed('sync_from_database')
+def sync_from_database(wait=True):
+    """Load rows written since the last sync, by this or any other session, and draw the latest snapshot
+
+    With wait False, a sync already running for another session is not waited
+    for and the snapshot it will replace is drawn instead.
+    """
+    global snapshot
+    snapshot = get_store().sync(wait)
+    get_engine().refresh()
+    return snapshot
+
+def add_donor(donor):
+    """Persist a new donor and return its row in the shared store"""
+    get_database().insert_donors([donor])
+    return sync_from_database().donors.row_of(donor['id'])
+
+@recorder.timed('submit_requests', volume=len)
+def submit_requests(requests):
+    """Store new blood requests and notify the nearest donors for each, through the engine"""
+    results = get_engine().submit(requests)
+    sync_from_database()
+    return results
+
+def set_request_status(request, status):
+    """Move a request to a new status (e.g. Fulfilled) and persist it"""
+    get_store().set_request_status(request['id'], status)
+    sync_from_database()
+
+def set_donor_status(donor_id, status):
+    """Change a donor's availability for matching and in the shared store"""
+    get_engine().set_donor_status(donor_id, status)
+    sync_from_database()
+
+def award_points(donor_id, points):
+    """Add points to a donor, keeping the leaderboards in step"""
+    get_store().award_points(donor_id, points)
 
 # Sample data for demonstration
+@st.cache_resource
 def initialize_sample_data():
-    if not st.session_state.donors:
+    """Seed an empty database with demo donors, checked once per process"""
+    db = get_database()
+    if not db.load_donors(limit=1):
         sample_donors = [
             {
                 'id': str(uuid.uuid4()),
@@ -127,19 +225,7 @@ def initialize_sample_data():
                 'badges': ['Rare Blood Hero']
             }
         ]
-        st.session_state.donors.extend(sample_donors)
-
-# Blood type compatibility
-BLOOD_COMPATIBILITY = {
-    'O-': ['O-', 'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+'],
-    'O+': ['O+', 'A+', 'B+', 'AB+'],
-    'A-': ['A-', 'A+', 'AB-', 'AB+'],
-    'A+': ['A+', 'AB+'],
-    'B-': ['B-', 'B+', 'AB-', 'AB+'],
-    'B+': ['B+', 'AB+'],
-    'AB-': ['AB-', 'AB+'],
-    'AB+': ['AB+']
-}
+        db.insert_donors(sample_donors)
 
 # Main header
 st.markdown("""
@@ -149,8 +235,10 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Initialize sample data
+# Seed an empty database, then load rows written since the last rerun. A
+# rerun never waits on another session's sync; it draws the latest snapshot
 initialize_sample_data()
+sync_from_database(wait=False)
 
 # Sidebar navigation
 st.sidebar.title("Navigation")
@@ -161,92 +249,270 @@ page = st.sidebar.radio("Go to", [
     "🔍 Find Donors",
     "📱 Notifications",
     "📊 Analytics",
-    "🏆 Leaderboard"
-])
+    "🏆 Leaderboard",
+    "⚙️ Performance"
+], key='page')
+
+if st.session_state.current_user is not None:
+    unread = snapshot.inbox.unread_count(st.session_state.current_user)
+    if unread:
+        st.sidebar.caption(f"🔔 {unread} unread notifications")
+
+NOTIFICATIONS_PER_PAGE = 20
+# Seconds between background checks for new alerts and responses
+ALERT_POLL_SECONDS = 10
+DONORS_PER_PAGE = 20
+# Find Donors result sets kept for all sessions, each for one filter set and donor version
+SEARCH_CACHE_ENTRIES = 32
+# Analytics chart frames kept, one per rollup version and grouping; older ones are evicted
+ANALYTICS_CACHE_ENTRIES = 16
+# Points for accepting a blood request
+RESPONSE_POINTS = 10
 
 # Helper functions
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points using geopy"""
-    return geodesic((lat1, lon1), (lat2, lon2)).kilometers
-
-def find_compatible_donors(blood_type, patient_lat, patient_lon, radius=10):
-    """Find compatible donors within radius"""
-    compatible_donors = []
-    
-    for donor in st.session_state.donors:
-        if donor['status'] == 'Available':
-            # Check blood compatibility
-            if blood_type in BLOOD_COMPATIBILITY.get(donor['blood_type'], []):
-                # Check distance
-                distance = calculate_distance(
-                    patient_lat, patient_lon,
-                    donor['latitude'], donor['longitude']
-                )
-                if distance <= radius:
-                    donor_info = donor.copy()
-                    donor_info['distance'] = distance
-                    compatible_donors.append(donor_info)
-    
-    return sorted(compatible_donors, key=lambda x: x['distance'])
-
-def send_notification(donor_id, message, request_id=None):
-    """Send notification to donor"""
-    notification = {
-        'id': str(uuid.uuid4()),
-        'donor_id': donor_id,
-        'message': message,
-        'timestamp': datetime.now(),
-        'request_id': request_id,
-        'status': 'unread'
+@st.cache_data(max_entries=ANALYTICS_CACHE_ENTRIES)
+def analytics_frames(token, version, granularity, _rollups):
+    """Chart data built from the activity rollups, recomputed only when they change"""
+    import pandas as pd
+    buckets = _rollups.counts[granularity]
+    starts = sorted(buckets)
+    trend_df = pd.DataFrame({
+        'Date': pd.to_datetime(starts),
+        'Donations': [buckets[start]['donation'] for start in starts],
+        'Requests': [buckets[start]['request'] for start in starts],
+        'Notifications': [buckets[start]['notification'] for start in starts],
+    })
+    minutes = sorted(_rollups.response_minutes)
+    response_df = pd.DataFrame({
+        'Minutes': minutes,
+        'Responses': [_rollups.response_minutes[m] for m in minutes],
+    })
+    location_df = pd.DataFrame(sorted(_rollups.donors_by_area.items()), columns=['Area', 'Count'])
+    return trend_df, response_df, location_df
+
+def locate(text, latitude=None, longitude=None):
+    """(coordinates, place): typed coordinates and None, else those of the gazetteer place the text names
+
+    coordinates is None when nothing was typed and no place matched.
+    """
+    if latitude is not None and longitude is not None:
+        return (latitude, longitude), None
+    place = get_gazetteer().geocode(text)
+    return ((place['latitude'], place['longitude']) if place else None), place
+
+def place_label(place):
+    """A gazetteer place as shown to users, such as Kondapur, Hyderabad"""
+    return place['name'] if place['name'] == place['city'] else f"{place['name']}, {place['city']}"
+
+def confirm_place(form, text, place):
+    """Whether a form may use the place its location text matched
+
+    The first submit of a given text only shows the match, so a wrong guess
+    can be corrected before anything is stored or any donor is notified.
+    Typed coordinates (place None) need no confirmation.
+    """
+    key = f'{form}_confirmed_location'
+    if place is None or st.session_state.get(key) == text:
+        return True
+    st.session_state[key] = text
+    st.info(f"📍 \"{text}\" was matched to {place_label(place)}. Submit again to confirm, "
+            "or enter the latitude and longitude to correct it.")
+    return False
+
+def resolve_location(text):
+    """Coordinates for a typed location: the gazetteer place, else the centre of donors registered there"""
+    coordinates, _ = locate(text)
+    if coordinates is not None:
+        return coordinates
+    store = snapshot.donors
+    needle = text.strip().lower()
+    codes = [code for code, location in enumerate(store.locations.values) if needle in location.lower()]
+    if not codes:
+        return None
+    in_area = np.isin(store.column('location_code'), codes)
+    return (float(store.column('latitude')[in_area].mean()),
+            float(store.column('longitude')[in_area].mean()))
+
+@recorder.timed('search_donors', volume=lambda result: len(result[0]))
+def search_donors(store, grid, blood_type, center, radius, eligible_only):
+    """Rows matching the Find Donors filters, available donors first
+
+    With a center, only donors within radius are returned, nearest first within
+    each status, together with their distances; otherwise distances is None.
+    """
+    if center is None:
+        rows = np.arange(len(store))
+    else:
+        rows = np.fromiter(grid.query(center[0], center[1], radius), dtype=np.int64)
+    
+    keep = np.ones(len(rows), dtype=bool)
+    if blood_type is not None:
+        keep &= store.column('blood_code')[rows] == BLOOD_CODES[blood_type]
+    if eligible_only:
+        keep &= eligible_mask(store.column('last_donation')[rows], time.time())
+    rows = rows[keep]
+    
+    distances = None
+    if center is not None:
+        with recorder.timer('distance_batch', volume=len(rows)):
+            positions, distances = distances_within(
+                center[0], center[1],
+                store.column('latitude')[rows], store.column('longitude')[rows], radius
+            )
+        rows = rows[positions]
+    
+    # Sort by availability (stable, so nearest stays first within a status)
+    order = np.argsort(store.column('status_code')[rows], kind='stable')
+    return rows[order], None if distances is None else distances[order]
+
+@st.cache_resource(max_entries=SEARCH_CACHE_ENTRIES)
+def shared_search(blood_type, center, radius, eligible_only, donors_version, minute, _snapshot):
+    """search_donors() results shared by every session until the filters or the donors change"""
+    return search_donors(_snapshot.donors, _snapshot.grid, blood_type, center, radius, eligible_only)
+
+def mark_notification(notification_id, status):
+    """Update a notification's read status and persist it"""
+    get_store().mark_notification(notification_id, status)
+
+def respond_to_request(notification, status):
+    """Record a donor accepting or declining the request behind a notification
+
+    The response is one atomic insert, so simultaneous responses to the same
+    request never overwrite each other and a donor can only respond once.
+    Returns False if the donor had already responded.
+    """
+    response = {
+        'request_id': notification['request_id'],
+        'donor_id': notification['donor_id'],
+        'status': status,
+        'responded_at': datetime.now(),
     }
-    st.session_state.notifications.append(notification)
+    recorded = get_database().add_response(response)
+    mark_notification(notification['id'], 'read')
+    if recorded and status == 'accepted':
+        award_points(notification['donor_id'], RESPONSE_POINTS)
+    sync_from_database()
+    return recorded
+
+def response_of(request, donor_id):
+    return next((r['status'] for r in request['responses'] if r['donor_id'] == donor_id), None)
+
+@st.fragment
+def notification_card(notification):
+    """One notification with its Accept/Decline buttons; a click reruns only this card"""
+    status_class = "success-card" if notification['status'] == 'read' else "request-card"
+    
+    delivery = get_dispatcher().delivery_status(notification['id'])
+    delivery_text = " · ".join(f"{channel.upper()}: {state}" for channel, state in delivery.items())
+    # A card rerun on its own reads the latest snapshot rather than the page's
+    request = get_store().snapshot().requests.get(notification['request_id'])
+    
+    col1, col2 = st.columns([4, 1])
+    
+    with col1:
+        st.markdown(f"""
+        <div class="{status_class}">
+            <strong>{notification['message']}</strong><br>
+            <small>{notification['timestamp'].strftime("%Y-%m-%d %H:%M")}</small>
+            <small style="float: right;">{delivery_text}</small>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col2:
+        if request is None:
+            return
+        responded = response_of(request, notification['donor_id'])
+        if responded is not None:
+            st.caption("✅ Accepted. The hospital can see your response." if responded == 'accepted'
+                       else "Declined")
+        elif request['status'] != 'Active':
+            st.caption(f"Request {request['status'].lower()}")
+        else:
+            # Callbacks run before the card redraws, so it shows the response at once
+            st.button("Accept", key=f"accept_{notification['id']}",
+                      on_click=respond_to_request, args=(notification, 'accepted'))
+            st.button("Decline", key=f"decline_{notification['id']}",
+                      on_click=respond_to_request, args=(notification, 'declined'))
+
+@st.fragment(run_every=ALERT_POLL_SECONDS)
+def new_alerts(donor_id, unread_shown):
+    """Poll for notifications that arrived since the page was drawn"""
+    arrived = sync_from_database(wait=False).inbox.unread_count(donor_id) - unread_shown
+    if arrived > 0:
+        col1, col2 = st.columns([4, 1])
+        col1.info(f"🔔 {arrived} new alert{'s' if arrived > 1 else ''}")
+        if col2.button("Show", key='show_new_alerts'):
+            st.session_state.notification_cursors = [None]
+            st.rerun()
+
+@st.fragment(run_every=ALERT_POLL_SECONDS)
+def recent_requests():
+    """Latest requests with live response counts, for hospitals watching the dashboard"""
+    requests = sync_from_database(wait=False).requests
+    if not len(requests):
+        return
+    st.write("**Recent Blood Requests:**")
+    for request in requests.latest(3):
+        urgency_class = "urgent-card" if request['urgency'] == 'Critical' else "request-card"
+        accepted = sum(r['status'] == 'accepted' for r in request['responses'])
+        declined = len(request['responses']) - accepted
+        st.markdown(f"""
+        <div class="{urgency_class}">
+            <strong>{request['patient_name']}</strong> needs {request['blood_type']} blood<br>
+            Location: {request['location']}<br>
+            Urgency: {request['urgency']} · Status: {request['status']}<br>
+            Responses: {accepted} accepted, {declined} declined<br>
+            Contact: {request['contact']}
+        </div>
+        """, unsafe_allow_html=True)
+        if request['status'] == 'Active':
+            if st.button("Mark Fulfilled", key=f"fulfil_{request['id']}"):
+                set_request_status(request, 'Fulfilled')
+                st.rerun()
+
+# Page content based on navigation, timed per page
+page_timing = recorder.start(f"page:{page.split(' ', 1)[1]}", volume=len(snapshot.donors))
 
-# Page content based on navigation
 if page == "🏠 Dashboard":
     col1, col2, col3, col4 = st.columns(4)
     
+    metrics = snapshot.metrics
+    
     with col1:
-        st.metric("Total Donors", len(st.session_state.donors))
+        st.metric("Total Donors", metrics.total_donors)
     
     with col2:
-        active_donors = len([d for d in st.session_state.donors if d['status'] == 'Available'])
-        st.metric("Active Donors", active_donors)
+        st.metric("Active Donors", metrics.active_donors)
     
     with col3:
-        pending_requests = len([r for r in st.session_state.requests if r['status'] == 'Active'])
-        st.metric("Pending Requests", pending_requests)
+        st.metric("Pending Requests", metrics.pending_requests)
+        by_urgency = metrics.active_requests_by_urgency
+        if metrics.pending_requests:
+            st.caption(" · ".join(f"{u}: {by_urgency[u]}" for u in URGENCY_LEVELS if by_urgency[u]))
     
     with col4:
-        total_donations = len(st.session_state.donations)
-        st.metric("Completed Donations", total_donations)
+        st.metric("Completed Donations", metrics.total_donations)
     
     # Recent activity
     st.subheader("Recent Activity")
     
-    # Show recent requests
-    if st.session_state.requests:
-        st.write("**Recent Blood Requests:**")
-        for request in st.session_state.requests[-3:]:
-            urgency_class = "urgent-card" if request['urgency'] == 'Critical' else "request-card"
-            st.markdown(f"""
-            <div class="{urgency_class}">
-                <strong>{request['patient_name']}</strong> needs {request['blood_type']} blood<br>
-                Location: {request['location']}<br>
-                Urgency: {request['urgency']}<br>
-                Contact: {request['contact']}
-            </div>
-            """, unsafe_allow_html=True)
+    # Show recent requests, refreshed in place as donors respond
+    recent_requests()
     
     # Blood type distribution chart
-    if st.session_state.donors:
+    if metrics.total_donors:
         st.subheader("Blood Type Distribution")
-        blood_types = [donor['blood_type'] for donor in st.session_state.donors]
-        blood_type_counts = pd.Series(blood_types).value_counts()
+        blood_type_counts = sorted(
+            ((count, blood_type) for blood_type, count in metrics.donors_by_blood_type.items() if count > 0),
+            reverse=True
+        )
         
-        fig = px.pie(values=blood_type_counts.values, 
-                    names=blood_type_counts.index,
-                    title="Available Donors by Blood Type")
-        st.plotly_chart(fig, use_container_width=True)
+        with recorder.timer('chart:blood_types'):
+            import plotly.express as px
+            fig = px.pie(values=[count for count, _ in blood_type_counts],
+                        names=[blood_type for _, blood_type in blood_type_counts],
+                        title="Available Donors by Blood Type")
+            st.plotly_chart(fig, use_container_width=True)
 
 elif page == "👤 Donor Registration":
     st.header("Donor Registration")
@@ -263,8 +529,10 @@ elif page == "👤 Donor Registration":
         
         with col2:
             location = st.text_input("Location*", placeholder="Area, City")
-            latitude = st.number_input("Latitude", value=17.4126, format="%.6f")
-            longitude = st.number_input("Longitude", value=78.4438, format="%.6f")
+            latitude = st.number_input("Latitude", value=None, format="%.6f",
+                                       help="Leave blank to look up from the location")
+            longitude = st.number_input("Longitude", value=None, format="%.6f",
+                                        help="Leave blank to look up from the location")
             medical_conditions = st.multiselect("Medical Conditions", 
                                               ['Diabetes', 'Hypertension', 'Heart Disease', 'None'])
         
@@ -274,7 +542,13 @@ elif page == "👤 Donor Registration":
         submitted = st.form_submit_button("Register as Donor")
         
         if submitted:
-            if name and blood_type and phone and location and terms_accepted:
+            coordinates, place = locate(location, latitude, longitude) if location else (None, None)
+            if not (name and blood_type and phone and location and terms_accepted):
+                st.error("Please fill all required fields and accept terms.")
+            elif coordinates is None:
+                st.error("Location not found. Please enter its latitude and longitude.")
+            elif confirm_place('registration', location, place):
+                latitude, longitude = coordinates
                 # Create new donor
                 new_donor = {
                     'id': str(uuid.uuid4()),
@@ -293,13 +567,53 @@ elif page == "👤 Donor Registration":
                     'registered_date': datetime.now()
                 }
                 
-                st.session_state.donors.append(new_donor)
+                add_donor(new_donor)
                 st.session_state.current_user = new_donor['id']
                 
                 st.success("Registration successful! Welcome to BloodConnect!")
                 st.balloons()
+
+    # Availability for the signed-in donor
+    my_row = snapshot.donors.row_of(st.session_state.current_user)
+    if my_row is not None:
+        me = snapshot.donors.record(my_row)
+        statuses = ['Available', 'Unavailable']
+        new_status = st.radio("Your availability", statuses,
+                              index=statuses.index(me['status']), horizontal=True)
+        if new_status != me['status']:
+            set_donor_status(me['id'], new_status)
+            st.success(f"Status updated to {new_status}.")
+
+    # Bulk onboarding of blood-bank registries
+    st.subheader("Bulk Import / Export")
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        upload = st.file_uploader("Import donors (CSV or Parquet)", type=FORMATS)
+        st.caption("Columns: name, blood_type, phone, location; optional latitude, longitude "
+                   "(looked up from location when blank), id, status, last_donation, points, "
+                   "badges (separated by ;)")
+        if upload is not None and st.button("Import Donors"):
+            file_format = 'parquet' if upload.name.lower().endswith('.parquet') else 'csv'
+            try:
+                imported, rejected, errors = import_donors(upload, file_format, get_database().insert_donors,
+                                                           geocode=get_gazetteer().geocode)
+            except ValueError as error:
+                st.error(str(error))
             else:
-                st.error("Please fill all required fields and accept terms.")
+                sync_from_database()
+                st.success(f"Imported {imported} donors.")
+                if rejected:
+                    st.warning(f"{rejected} rows were rejected. The first few are shown below.")
+                    st.dataframe(errors)
+    
+    with col2:
+        export_format = st.selectbox("Export format", FORMATS)
+        if st.button("Prepare Export"):
+            with tempfile.TemporaryFile() as target:
+                export_donors(snapshot.donors, target, export_format)
+                target.seek(0)
+                st.download_button("Download Donors", target.read(), file_name=f"donors.{export_format}")
 
 elif page == "🆘 Request Blood":
     st.header("Request Blood")
@@ -323,16 +637,24 @@ elif page == "🆘 Request Blood":
                                          placeholder="Any specific requirements or notes")
         
         # Location coordinates
-        req_latitude = st.number_input("Hospital Latitude", value=17.4126, format="%.6f")
-        req_longitude = st.number_input("Hospital Longitude", value=78.4438, format="%.6f")
+        req_latitude = st.number_input("Hospital Latitude", value=None, format="%.6f",
+                                       help="Leave blank to look up from the hospital and location")
+        req_longitude = st.number_input("Hospital Longitude", value=None, format="%.6f",
+                                        help="Leave blank to look up from the hospital and location")
         
         submitted = st.form_submit_button("Submit Request")
         
         if submitted:
-            if patient_name and blood_type and hospital_name and contact and location:
+            hospital_text = f"{hospital_name}, {location}"
+            coordinates, place = locate(hospital_text, req_latitude, req_longitude)
+            if not (patient_name and blood_type and hospital_name and contact and location):
+                st.error("Please fill all required fields.")
+            elif coordinates is None:
+                st.error("Hospital location not found. Please enter its latitude and longitude.")
+            elif confirm_place('request', hospital_text, place):
+                req_latitude, req_longitude = coordinates
                 # Create new request
                 new_request = {
-                    'id': str(uuid.uuid4()),
                     'patient_name': patient_name,
                     'blood_type': blood_type,
                     'units_needed': units_needed,
@@ -348,20 +670,19 @@ elif page == "🆘 Request Blood":
                     'responses': []
                 }
                 
-                st.session_state.requests.append(new_request)
-                
-                # Find compatible donors and send notifications
-                compatible_donors = find_compatible_donors(
-                    blood_type, req_latitude, req_longitude, radius=15
-                )
-                
-                notification_count = 0
-                for donor in compatible_donors[:10]:  # Notify top 10 closest donors
-                    message = f"🚨 URGENT: {patient_name} needs {blood_type} blood at {hospital_name}. Distance: {donor['distance']:.1f}km"
-                    send_notification(donor['id'], message, new_request['id'])
-                    notification_count += 1
+                # The engine stores the request and notifies the 10 closest
+                # compatible donors, widening the search if needed
+                result = submit_requests([new_request])[0]
+                compatible_donors, searched_radius = result['donors'], result['searched_km']
+                notification_count = len(result['notifications'])
                 
                 st.success(f"Request submitted successfully! {notification_count} nearby donors have been notified.")
+                if searched_radius > 15 and compatible_donors:
+                    st.info(f"Few donors nearby, so the search was widened to {searched_radius:g} km.")
+                
+                if is_rare_blood_type(blood_type):
+                    rare_pool = get_engine().available(blood_type)
+                    st.info(f"{blood_type} is a rare blood type: {rare_pool} available donors can give to it.")
                 
                 # Show matched donors
                 if compatible_donors:
@@ -376,9 +697,37 @@ elif page == "🆘 Request Blood":
                         </div>
                         """, unsafe_allow_html=True)
                 else:
-                    st.warning("No compatible donors found in the area. Request has been posted for wider notification.")
-            else:
-                st.error("Please fill all required fields.")
+                    st.warning(f"No compatible donors found within {searched_radius:g} km. The request stays active for donors who become available.")
+    
+    # Mass-casualty mode: match every open request at once
+    active_requests = [request for request in snapshot.requests if request['status'] == 'Active']
+    if len(active_requests) > 1:
+        st.subheader("Batch Donor Assignment")
+        st.caption(f"{len(active_requests)} active requests. Donors are spread across them, "
+                   "most urgent first, so nobody is asked to answer several at once.")
+        if st.button("Assign Donors to All Active Requests"):
+            with recorder.timer('assign_donors', volume=len(active_requests)):
+                assignments = get_engine().assign(active_requests)
+            sync_from_database()
+            notified = sum(len(donors) for donors in assignments.values())
+            
+            # Donors notified earlier count towards a request, and are never asked twice
+            totals = {r['id']: len(get_database().notified_donors(r['id'])) for r in active_requests}
+            filled = sum(totals[r['id']] >= r['units_needed'] * DONORS_PER_UNIT for r in active_requests)
+            st.success(f"Notified {notified} more donors; {filled} of {len(active_requests)} "
+                       "requests have a full set of donors.")
+            summary = [
+                {
+                    'Patient': request['patient_name'],
+                    'Blood Type': request['blood_type'],
+                    'Urgency': request['urgency'],
+                    'Units': request['units_needed'],
+                    'Newly Notified': len(assignments[request['id']]),
+                    'Donors Notified': totals[request['id']],
+                }
+                for request in active_requests
+            ]
+            st.dataframe(summary, hide_index=True, use_container_width=True)
 
 elif page == "🔍 Find Donors":
     st.header("Find Donors")
@@ -390,189 +739,225 @@ elif page == "🔍 Find Donors":
                                        ['All'] + ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-'])
         search_location = st.text_input("Location (optional)", placeholder="Enter location to search")
         radius = st.slider("Search Radius (km)", 1, 50, 10)
+        eligible_only = st.checkbox("Only donors eligible to donate now")
         
-        # Filter donors
-        filtered_donors = st.session_state.donors.copy()
-        
-        if search_blood_type != 'All':
-            filtered_donors = [d for d in filtered_donors if d['blood_type'] == search_blood_type]
+        center = resolve_location(search_location) if search_location else None
+        if search_location and center is None:
+            st.warning("Location not recognised; showing donors everywhere.")
         
-        # Sort by availability
-        filtered_donors.sort(key=lambda x: x['status'] == 'Available', reverse=True)
+        # The sorted result set is shared by every session until the filters or
+        # the donors change; a session keeps only its filters and page number
+        store = snapshot.donors
+        search_key = (None if search_blood_type == 'All' else search_blood_type, center, radius,
+                      eligible_only, store.version, int(time.time() // 60) if eligible_only else 0)
+        if st.session_state.get('donor_search') != search_key:
+            st.session_state.donor_search = search_key
+            st.session_state.donor_search_page = 0
+        filtered_rows, filtered_distances = shared_search(*search_key, snapshot)
     
     with col2:
-        st.subheader(f"Found {len(filtered_donors)} donors")
+        total = len(filtered_rows)
+        page_count = max(1, -(-total // DONORS_PER_PAGE))
+        page_number = min(st.session_state.donor_search_page, page_count - 1)
+        start = page_number * DONORS_PER_PAGE
         
-        for donor in filtered_donors:
-            status_color = "28a745" if donor['status'] == 'Available' else "6c757d"
-            last_donation = donor['last_donation'].strftime("%B %Y") if donor['last_donation'] else "Never"
+        st.subheader(f"Found {total} donors")
+        
+        # Only the current page is materialised and rendered
+        page_rows = filtered_rows[start:start + DONORS_PER_PAGE]
+        with recorder.timer('render:donor_cards', volume=len(page_rows)):
+            for position, donor in enumerate(store.records(page_rows), start):
+                status_color = "28a745" if donor['status'] == 'Available' else "6c757d"
+                last_donation = donor['last_donation'].strftime("%B %Y") if donor['last_donation'] else "Never"
+                distance = f"Distance: {filtered_distances[position]:.1f}km<br>" if filtered_distances is not None else ""
             
-            st.markdown(f"""
-            <div class="donor-card">
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <div>
-                        <strong>{donor['name']}</strong> - {donor['blood_type']}<br>
-                        Location: {donor['location']}<br>
-                        Last Donation: {last_donation}<br>
-                        Points: {donor['points']} | Badges: {', '.join(donor['badges'])}
-                    </div>
-                    <div>
-                        <span style="color: #{status_color}; font-weight: bold;">●</span> {donor['status']}<br>
-                        <button style="background: #007bff; color: white; border: none; padding: 5px 10px; border-radius: 3px; cursor: pointer;">
-                            Contact
-                        </button>
+                st.markdown(f"""
+                <div class="donor-card">
+                    <div style="display: flex; justify-content: space-between; align-items: center;">
+                        <div>
+                            <strong>{donor['name']}</strong> - {donor['blood_type']}<br>
+                            Location: {donor['location']}<br>
+                            {distance}Last Donation: {last_donation}<br>
+                            Points: {donor['points']} | Badges: {', '.join(donor['badges'])}
+                        </div>
+                        <div>
+                            <span style="color: #{status_color}; font-weight: bold;">●</span> {donor['status']}<br>
+                            <button style="background: #007bff; color: white; border: none; padding: 5px 10px; border-radius: 3px; cursor: pointer;">
+                                Contact
+                            </button>
+                        </div>
                     </div>
                 </div>
-            </div>
-            """, unsafe_allow_html=True)
+                """, unsafe_allow_html=True)
+        
+        if page_count > 1:
+            prev_col, info_col, next_col = st.columns([1, 2, 1])
+            with prev_col:
+                if page_number > 0 and st.button("← Previous"):
+                    st.session_state.donor_search_page = page_number - 1
+                    st.rerun()
+            with info_col:
+                st.caption(f"Page {page_number + 1} of {page_count}")
+            with next_col:
+                if page_number < page_count - 1 and st.button("Next →"):
+                    st.session_state.donor_search_page = page_number + 1
+                    st.rerun()
     
     # Map visualization
-    if st.session_state.donors:
+    if len(store):
         st.subheader("Donor Locations")
         
-        # Create map data
-        map_data = []
-        for donor in filtered_donors:
-            map_data.append({
-                'lat': donor['latitude'],
-                'lon': donor['longitude'],
-                'name': donor['name'],
-                'blood_type': donor['blood_type'],
-                'status': donor['status']
-            })
-        
-        if map_data:
-            df = pd.DataFrame(map_data)
-            
-            # Create map
-            fig = px.scatter_mapbox(
-                df, lat="lat", lon="lon", 
-                hover_name="name",
-                hover_data=["blood_type", "status"],
-                color="blood_type",
-                size_max=15,
-                zoom=10,
-                height=400
-            )
-            
-            fig.update_layout(
-                mapbox_style="open-street-map",
-                mapbox=dict(center=dict(lat=17.4126, lon=78.4438))
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
+        if total:
+            zoom = st.slider("Map zoom", 3, 15, 10)
+            # Centre on the searched location, else on the donors found
+            map_center = center or (float(store.column('latitude')[filtered_rows].mean()),
+                                    float(store.column('longitude')[filtered_rows].mean()))
+            with recorder.timer('chart:donor_map', volume=total):
+                from components.map_view import donor_map
+                fig, caption = donor_map(store, filtered_rows, map_center, zoom)
+                st.caption(caption)
+                st.plotly_chart(fig, use_container_width=True)
 
 elif page == "📱 Notifications":
     st.header("Notifications")
     
-    # Filter notifications for current user (if logged in)
-    user_notifications = st.session_state.notifications
+    inbox = snapshot.inbox
+    donor_id = st.session_state.current_user
     
-    if not user_notifications:
-        st.info("No notifications yet.")
+    if donor_id is None:
+        st.info("Register as a donor to receive notifications.")
     else:
-        # Sort by timestamp (newest first)
-        user_notifications.sort(key=lambda x: x['timestamp'], reverse=True)
+        def reset_pages():
+            st.session_state.notification_cursors = [None]
+        
+        show_read = st.toggle("Show read notifications", on_change=reset_pages)
+        unread = inbox.unread_count(donor_id)
+        st.caption(f"{unread} unread")
+        new_alerts(donor_id, unread)
+        
+        # Only this page's notifications are fetched, newest first
+        cursors = st.session_state.notification_cursors
+        user_notifications, older_cursor = inbox.page(
+            donor_id, cursors[-1], NOTIFICATIONS_PER_PAGE, unread_only=not show_read
+        )
+        
+        if not user_notifications:
+            st.info("No notifications yet." if show_read else "No unread notifications.")
         
         for notification in user_notifications:
-            status_class = "success-card" if notification['status'] == 'read' else "request-card"
-            
-            col1, col2 = st.columns([4, 1])
-            
-            with col1:
-                st.markdown(f"""
-                <div class="{status_class}">
-                    <strong>{notification['message']}</strong><br>
-                    <small>{notification['timestamp'].strftime("%Y-%m-%d %H:%M")}</small>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col2:
-                if notification['request_id']:
-                    if st.button("Accept", key=f"accept_{notification['id']}"):
-                        # Handle acceptance
-                        notification['status'] = 'read'
-                        st.success("Request accepted! Patient will be notified.")
-                    
-                    if st.button("Decline", key=f"decline_{notification['id']}"):
-                        # Handle decline
-                        notification['status'] = 'read'
-                        st.info("Request declined.")
+            notification_card(notification)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if len(cursors) > 1 and st.button("← Newer"):
+                cursors.pop()
+                st.rerun()
+        with col2:
+            if older_cursor is not None and st.button("Older →"):
+                cursors.append(older_cursor)
+                st.rerun()
 
 elif page == "📊 Analytics":
+    import plotly.express as px
+    
     st.header("Platform Analytics")
     
+    rollups = snapshot.rollups
+    granularity = st.radio("Group by", GRANULARITIES, index=2, horizontal=True)
+    trend_df, response_df, location_df = analytics_frames(
+        rollups.token, rollups.version, granularity, rollups
+    )
+    
     # Time series data for donations
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("Donation Trends")
         
-        # Generate sample time series data
-        dates = pd.date_range(start='2024-01-01', end='2024-12-31', freq='M')
-        donations_per_month = np.random.randint(10, 50, len(dates))
-        
-        trend_df = pd.DataFrame({
-            'Date': dates,
-            'Donations': donations_per_month
-        })
-        
-        fig = px.line(trend_df, x='Date', y='Donations', title='Monthly Donations')
-        st.plotly_chart(fig, use_container_width=True)
+        if len(trend_df):
+            with recorder.timer('chart:activity_trend', volume=len(trend_df)):
+                fig = px.line(trend_df, x='Date', y=['Donations', 'Requests', 'Notifications'],
+                              title=f'{granularity} Activity')
+                st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No donations or requests recorded yet.")
     
     with col2:
         st.subheader("Response Time")
         
-        # Sample response time data
-        response_times = np.random.normal(15, 5, 100)  # Average 15 minutes
-        
-        fig = px.histogram(response_times, nbins=20, title='Average Response Time (minutes)')
-        st.plotly_chart(fig, use_container_width=True)
+        if len(response_df):
+            with recorder.timer('chart:response_time', volume=len(response_df)):
+                fig = px.bar(response_df, x='Minutes', y='Responses',
+                             title='Time from Request to Donor Response (minutes)')
+                st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No donor responses recorded yet.")
     
     # Geographic distribution
     st.subheader("Geographic Distribution")
     
-    if st.session_state.donors:
-        location_counts = {}
-        for donor in st.session_state.donors:
-            area = donor['location'].split(',')[0]  # Get area name
-            location_counts[area] = location_counts.get(area, 0) + 1
-        
-        location_df = pd.DataFrame(list(location_counts.items()), columns=['Area', 'Count'])
-        
-        fig = px.bar(location_df, x='Area', y='Count', title='Donors by Area')
-        st.plotly_chart(fig, use_container_width=True)
+    if len(location_df):
+        with recorder.timer('chart:donors_by_area', volume=len(location_df)):
+            fig = px.bar(location_df, x='Area', y='Count', title='Donors by Area')
+            st.plotly_chart(fig, use_container_width=True)
     
     # Key metrics
     st.subheader("Key Metrics")
     
+    metrics = snapshot.metrics
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("Average Response Time", "12 minutes", "-2 min")
+        average = rollups.average_response_minutes
+        st.metric("Average Response Time", "—" if average is None else f"{average:.0f} minutes")
     
     with col2:
-        st.metric("Success Rate", "85%", "+5%")
+        fulfilled = metrics.requests_by_status['Fulfilled']
+        st.metric("Success Rate",
+                  f"{fulfilled / metrics.total_requests:.0%}" if metrics.total_requests else "—")
     
     with col3:
-        st.metric("User Satisfaction", "4.8/5", "+0.2")
+        acceptance = rollups.acceptance_rate
+        st.metric("Acceptance Rate", "—" if acceptance is None else f"{acceptance:.0%}")
 
 elif page == "🏆 Leaderboard":
     st.header("Donor Leaderboard")
     
-    # Sort donors by points
-    top_donors = sorted(st.session_state.donors, key=lambda x: x['points'], reverse=True)
+    store = snapshot.donors
+    leaderboards = snapshot.leaderboards
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        scope = st.selectbox("Leaderboard", ["Overall", "By Area", "By Blood Type"])
+    with col2:
+        if scope == "By Area":
+            area = st.selectbox("Area", sorted(leaderboards.by_area))
+            board = leaderboards.by_area.get(area, Leaderboard())
+        elif scope == "By Blood Type":
+            # get() rather than [], which would add an empty board to the shared snapshot
+            board = leaderboards.by_blood_type.get(st.selectbox("Blood Type", BLOOD_TYPES), Leaderboard())
+        else:
+            board = leaderboards.overall
+    
+    # Top 10 are read straight off the maintained ranking
+    top_rows = [row for row, points in board.top(10)]
+    top_donors = store.records(top_rows)
+    
+    my_row = store.row_of(st.session_state.current_user)
+    if my_row is not None and my_row in board:
+        st.caption(f"Your rank: #{board.rank(my_row)} of {len(board)}")
     
     st.subheader("Top Donors")
     
-    for i, donor in enumerate(top_donors[:10], 1):
+    for i, (row, donor) in enumerate(zip(top_rows, top_donors), 1):
         medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}."
+        champion = " 📍" if leaderboards.is_local_champion(row, donor['location']) else ""
         
         st.markdown(f"""
         <div class="donor-card">
             <div style="display: flex; justify-content: space-between; align-items: center;">
                 <div>
-                    <strong>{medal} {donor['name']}</strong> - {donor['blood_type']}<br>
+                    <strong>{medal} {donor['name']}</strong>{champion} - {donor['blood_type']}<br>
                     Badges: {', '.join(donor['badges'])}<br>
                     Location: {donor['location']}
                 </div>
@@ -608,6 +993,37 @@ elif page == "🏆 Leaderboard":
         </div>
         """, unsafe_allow_html=True)
 
+elif page == "⚙️ Performance":
+    st.header("Performance")
+    
+    # Recording is process-wide, so it covers every session's reruns
+    recorder.enabled = st.toggle("Record timings", value=recorder.enabled)
+    
+    timings = recorder.summary()
+    if timings:
+        over = [t['operation'].split(':', 1)[1] for t in timings if t['operation'].startswith('rerun:')
+                and t['p95_ms'] > rerun_budget_ms(t['operation'].split(':', 1)[1])]
+        if over:
+            st.warning(f"Over their rerun time budget (p95): {', '.join(over)}")
+        st.dataframe(timings, hide_index=True, use_container_width=True)
+    else:
+        st.info("No timings recorded yet. Turn recording on and use the app.")
+    
+    st.caption(f"Prometheus metrics are written to {METRICS_PATH} while recording is on.")
+    st.caption(f"Shared store version {snapshot.version}: {len(snapshot.donors)} donors and "
+               f"{len(snapshot.requests)} requests, read by every session.")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Write Metrics File"):
+            recorder.write_prometheus(METRICS_PATH)
+            st.success(f"Wrote {METRICS_PATH}")
+    with col2:
+        if st.button("Reset Timings"):
+            recorder.reset()
+            st.rerun()
+
+page_timing.stop()
+
 # Footer
 st.markdown("---")
 st.markdown("""
@@ -616,3 +1032,7 @@ st.markdown("""
     <p>🚨 Emergency Helpline: 1910 | 📧 Support: help@bloodconnect.org</p>
 </div>
 """, unsafe_allow_html=True)
+
+if recorder.enabled:
+    recorder.record(f"rerun:{page.split(' ', 1)[1]}", time.perf_counter() - rerun_started)
+recorder.maybe_write(METRICS_PATH)
@@ -0,0 +1 @@
+"""Reusable UI components for the BloodConnect Streamlit app"""
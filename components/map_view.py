@@ -0,0 +1,80 @@
+"""Donor map: individual points when few are in view, server-side clusters otherwise"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from utils.donor_store import BLOOD_TYPES, STATUSES
+from utils.location_utils import aggregate_points
+
+# Above this many donors in view the map shows grid clusters instead of points
+MAX_POINTS = 2000
+MAP_WIDTH_PX = 800
+MAP_HEIGHT_PX = 400
+# Cluster cells per 256px map tile
+CELLS_PER_TILE = 4
+
+
+def viewport(center, zoom):
+    """Approximate (south, north, west, east) bounds of the map at a zoom level"""
+    tile_deg = 360.0 / 2 ** zoom
+    half_lon = tile_deg * MAP_WIDTH_PX / 256 / 2
+    half_lat = tile_deg * MAP_HEIGHT_PX / 256 / 2 * np.cos(np.radians(center[0]))
+    return center[0] - half_lat, center[0] + half_lat, center[1] - half_lon, center[1] + half_lon
+
+
+def donor_map(store, rows, center, zoom):
+    """Plotly figure for donor rows and a caption describing what is drawn
+
+    Donors outside the viewport are dropped first; if more than MAX_POINTS
+    remain, they are aggregated into grid cells sized for the zoom level with
+    per-blood-type counts, so the payload stays small at any data size.
+    """
+    lats = store.column('latitude')[rows]
+    lons = store.column('longitude')[rows]
+    south, north, west, east = viewport(center, zoom)
+    in_view = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+    rows, lats, lons = rows[in_view], lats[in_view], lons[in_view]
+    codes = store.column('blood_code')[rows]
+
+    if len(rows) <= MAX_POINTS:
+        df = pd.DataFrame({
+            'lat': lats,
+            'lon': lons,
+            'name': [store.names[row] for row in rows],
+            'blood_type': np.array(BLOOD_TYPES)[codes],
+            'status': np.array(STATUSES)[store.column('status_code')[rows]]
+        })
+        fig = px.scatter_mapbox(
+            df, lat="lat", lon="lon",
+            hover_name="name",
+            hover_data=["blood_type", "status"],
+            color="blood_type",
+            size_max=15,
+            zoom=zoom,
+            height=MAP_HEIGHT_PX
+        )
+        caption = f"{len(rows)} donors in view"
+    else:
+        cell_deg = 360.0 / 2 ** zoom / CELLS_PER_TILE
+        mean_lat, mean_lon, counts, per_type = aggregate_points(lats, lons, codes, cell_deg, len(BLOOD_TYPES))
+        df = pd.DataFrame(per_type, columns=BLOOD_TYPES)
+        df['lat'] = mean_lat
+        df['lon'] = mean_lon
+        df['donors'] = counts
+        df['main_type'] = np.array(BLOOD_TYPES)[per_type.argmax(axis=1)]
+        fig = px.scatter_mapbox(
+            df, lat="lat", lon="lon",
+            size="donors",
+            color="main_type",
+            hover_data=["donors"] + BLOOD_TYPES,
+            size_max=40,
+            zoom=zoom,
+            height=MAP_HEIGHT_PX
+        )
+        caption = f"{len(rows)} donors in view, grouped into {len(counts)} clusters; zoom in for individual donors"
+
+    fig.update_layout(
+        mapbox_style="open-street-map",
+        mapbox=dict(center=dict(lat=center[0], lon=center[1]))
+    )
+    return fig, caption
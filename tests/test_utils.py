@@ -0,0 +1,30 @@
+"""Tests for the utils package"""
+import io
+
+from utils.bulk_io import import_donors
+from utils.database import Database
+from utils.shared_store import SharedStore
+
+CSV_HEADER = "name,blood_type,phone,location,latitude,longitude,points\n"
+
+
+def test_import_rejects_points_the_store_cannot_hold(tmp_path):
+    database = Database(str(tmp_path / 'donors.db'))
+    store = SharedStore(database)
+    store.sync()
+    rows = [
+        "Asha,O+,+91 98765 43210,Hyderabad,17.38,78.48,120",
+        "Ravi,A+,+91 98765 43211,Hyderabad,17.39,78.49,3000000000",
+        "Meena,B+,+91 98765 43212,Hyderabad,17.40,78.50,1.5",
+        "Kiran,AB+,+91 98765 43213,Hyderabad,17.41,78.51,x",
+    ]
+    source = io.StringIO(CSV_HEADER + "\n".join(rows) + "\n")
+
+    imported, rejected, errors = import_donors(source, 'csv', database.insert_donors)
+
+    assert (imported, rejected) == (1, 3)
+    assert errors['name'].tolist() == ['Ravi', 'Meena', 'Kiran']
+    assert set(errors['error']) == {"invalid points"}
+    snapshot = store.sync()
+    assert snapshot.donors.names[:] == ['Asha']
+    assert snapshot.donors.column('points').tolist() == [120]
@@ -0,0 +1,107 @@
+"""Time-bucketed rollups of platform activity for the Analytics page"""
+import copy
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from utils.leaderboard import area_of
+
+GRANULARITIES = ['Daily', 'Weekly', 'Monthly']
+
+
+def bucket_start(when, granularity):
+    """Start date of the day, week (Monday) or month containing a datetime"""
+    day = when.date()
+    if granularity == 'Daily':
+        return day
+    if granularity == 'Weekly':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+class ActivityRollups:
+    """Event counts per day, week and month, plus response and area aggregates
+
+    Everything is updated as events arrive, so charts never scan raw history.
+    token and version together identify the current contents for caching.
+    """
+
+    def __init__(self):
+        self.token = uuid.uuid4().hex
+        self.version = 0
+        self.counts = {granularity: defaultdict(Counter) for granularity in GRANULARITIES}
+        self.totals = Counter()
+        self.response_minutes = Counter()
+        self.response_minutes_total = 0.0
+        self.responses_by_status = Counter()
+        self.donors_by_area = Counter()
+        # (granularity, start) of the buckets these rollups may change; None for all of them
+        self._owned = None
+
+    def copy(self):
+        """Rollups that can change without changing these; the token is kept, so versions stay comparable
+
+        Each day's, week's or month's counts are copied only when the copy first
+        counts into them.
+        """
+        rollups = copy.copy(self)
+        rollups.counts = {granularity: defaultdict(Counter, buckets) for granularity, buckets in self.counts.items()}
+        for name in ('totals', 'response_minutes', 'responses_by_status', 'donors_by_area'):
+            setattr(rollups, name, Counter(getattr(self, name)))
+        rollups._owned = set()
+        return rollups
+
+    def _bucket(self, granularity, start):
+        """The counts of one bucket, safe to change in place"""
+        buckets = self.counts[granularity]
+        if self._owned is not None and (granularity, start) not in self._owned:
+            buckets[start] = Counter(buckets.get(start, ()))
+            self._owned.add((granularity, start))
+        return buckets[start]
+
+    def record(self, event, when):
+        """Count an event ('request', 'donation', 'notification', ...) at a time"""
+        for granularity in self.counts:
+            self._bucket(granularity, bucket_start(when, granularity))[event] += 1
+        self.totals[event] += 1
+        self.version += 1
+
+    def record_response(self, requested_at, response):
+        """Count a donor's response to a request and how long it took"""
+        minutes = max((response['responded_at'] - requested_at).total_seconds() / 60, 0.0)
+        self.response_minutes[int(minutes)] += 1
+        self.response_minutes_total += minutes
+        self.responses_by_status[response['status']] += 1
+        self.record('response', response['responded_at'])
+
+    def request_loaded(self, request):
+        """Count a request and any responses it already carries"""
+        self.record('request', request['created_at'])
+        for response in request.get('responses', []):
+            self.record_response(request['created_at'], response)
+
+    def donors_added(self, locations):
+        """Count a batch of donors towards their areas"""
+        self.donors_by_area.update(area_of(location) for location in locations)
+        self.version += 1
+
+    def donor_moved(self, old_location, new_location):
+        """Count a donor towards the area of their new location instead of their old one"""
+        old_area = area_of(old_location)
+        self.donors_by_area[old_area] -= 1
+        if not self.donors_by_area[old_area]:
+            del self.donors_by_area[old_area]
+        self.donors_by_area[area_of(new_location)] += 1
+        self.version += 1
+
+    @property
+    def average_response_minutes(self):
+        """Mean minutes from request to donor response, None before any response"""
+        count = sum(self.responses_by_status.values())
+        return self.response_minutes_total / count if count else None
+
+    @property
+    def acceptance_rate(self):
+        """Share of responses that accepted the request, None before any response"""
+        count = sum(self.responses_by_status.values())
+        return self.responses_by_status['accepted'] / count if count else None
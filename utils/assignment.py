@@ -0,0 +1,106 @@
+"""Batch assignment of donors to many simultaneous blood requests"""
+from collections import defaultdict
+
+import numpy as np
+
+from utils.blood_matching import DONOR_MASKS
+from utils.metrics import URGENCY_LEVELS
+
+# Donors notified per unit of blood needed
+DONORS_PER_UNIT = 3
+# Candidates fetched per donor still needed
+CANDIDATE_FACTOR = 2
+ROUNDS = 8
+# Batches need few donors per place, so the working grid is finer than the
+# session's and candidate rings start small
+CELL_KM = 2.0
+START_KM = 2.0
+
+
+def assign_donors(requests, buckets, latitudes, longitudes, max_radius_km,
+                  donors_per_unit=DONORS_PER_UNIT, max_per_donor=1, rounds=ROUNDS, notified=None):
+    """Spread eligible donors over open requests, most urgent first
+
+    Each request needs units_needed * donors_per_unit donors, less those
+    already notified about it (notified maps request id to a set of rows);
+    those donors are not picked again for any request at the same place and
+    blood type. Urgency levels are served strictly in order, so Critical
+    requests get first pick. Within a level, requests for the same blood type at the same place share one
+    candidate list from the compatible buckets (within max_radius_km[urgency]).
+    All (group, donor, distance) pairs of a round are sorted by distance once
+    and taken greedily while the group still needs donors. A donor leaves the
+    working copy of the buckets after max_per_donor assignments, so each round
+    only sees free donors; groups left short fetch again until their radius
+    is empty.
+
+    latitudes and longitudes are the coordinate columns indexed by row.
+    Returns {request id: [(row, distance_km), ...]} nearest first.
+    """
+    free = buckets.regrid(CELL_KM, latitudes, longitudes)
+    notified = notified or {}
+    assigned = {request['id']: [] for request in requests}
+    need = {
+        request['id']: max(request['units_needed'] * donors_per_unit - len(notified.get(request['id'], ())), 0)
+        for request in requests
+    }
+    load = defaultdict(int)
+
+    for urgency in URGENCY_LEVELS:
+        groups = defaultdict(list)
+        for request in requests:
+            if request['urgency'] == urgency:
+                groups[(request['blood_type'], request['latitude'], request['longitude'])].append(request)
+        keys = list(groups)
+        # Older requests in a group are filled first
+        members = [sorted(groups[key], key=lambda request: request['created_at']) for key in keys]
+        remaining = [sum(need[r['id']] for r in group) for group in members]
+        chosen = [set().union(*(notified.get(r['id'], ()) for r in group)) for group in members]
+        cursor = [0] * len(keys)
+        exhausted = [False] * len(keys)
+
+        for _ in range(rounds):
+            open_groups = [g for g in range(len(keys)) if remaining[g] and not exhausted[g]]
+            if not open_groups:
+                break
+            pair_groups, pair_rows, pair_distances = [], [], []
+            for g in open_groups:
+                blood_type, lat, lon = keys[g]
+                if not free.count(DONOR_MASKS[blood_type]):
+                    exhausted[g] = True
+                    continue
+                # Donors this group already holds stay in the pool when max_per_donor > 1
+                k = len(chosen[g]) + remaining[g] * CANDIDATE_FACTOR
+                # Haversine order is plenty for spreading donors around
+                rows, distances, _ = free.nearest(
+                    DONOR_MASKS[blood_type], lat, lon, k, latitudes, longitudes,
+                    start_km=START_KM, max_km=max_radius_km[urgency], exact=False
+                )
+                exhausted[g] = len(rows) < k
+                pair_groups.append(np.full(len(rows), g))
+                pair_rows.append(rows)
+                pair_distances.append(distances)
+            if not pair_groups:
+                break
+            pair_groups = np.concatenate(pair_groups)
+            pair_rows = np.concatenate(pair_rows)
+            pair_distances = np.concatenate(pair_distances)
+
+            order = np.argsort(pair_distances, kind='stable')
+            for g, row, distance in zip(pair_groups[order].tolist(), pair_rows[order].tolist(),
+                                        pair_distances[order].tolist()):
+                if not remaining[g] or row in chosen[g] or load[row] >= max_per_donor:
+                    continue
+                # The oldest request in the group still short of donors
+                while len(assigned[members[g][cursor[g]]['id']]) >= need[members[g][cursor[g]]['id']]:
+                    cursor[g] += 1
+                request = members[g][cursor[g]]
+                assigned[request['id']].append((row, distance))
+                chosen[g].add(row)
+                load[row] += 1
+                remaining[g] -= 1
+                if load[row] == max_per_donor:
+                    free.remove(row)
+
+    for pairs in assigned.values():
+        pairs.sort(key=lambda pair: pair[1])
+    return assigned
@@ -0,0 +1,133 @@
+"""Blood type compatibility and blood-type buckets of available donors"""
+import numpy as np
+
+from utils.donor_store import BLOOD_CODES, BLOOD_TYPES
+from utils.location_utils import HAVERSINE_REL_ERROR, GridIndex, distances_within, haversine_km
+
+# Blood type compatibility
+BLOOD_COMPATIBILITY = {
+    'O-': ['O-', 'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+'],
+    'O+': ['O+', 'A+', 'B+', 'AB+'],
+    'A-': ['A-', 'A+', 'AB-', 'AB+'],
+    'A+': ['A+', 'AB+'],
+    'B-': ['B-', 'B+', 'AB-', 'AB+'],
+    'B+': ['B+', 'AB+'],
+    'AB-': ['AB-', 'AB+'],
+    'AB+': ['AB+']
+}
+
+# Recipient type -> 8-bit mask of the donor blood codes that can give to it
+DONOR_MASKS = {
+    recipient: sum(1 << BLOOD_CODES[donor] for donor, recipients in BLOOD_COMPATIBILITY.items()
+                   if recipient in recipients)
+    for recipient in BLOOD_TYPES
+}
+
+# Rh-negative types are rare in the donor population
+RARE_BLOOD_MASK = sum(1 << BLOOD_CODES[blood_type] for blood_type in ['A-', 'B-', 'AB-', 'O-'])
+
+
+def mask_codes(mask):
+    """Blood codes set in a mask"""
+    return [code for code in range(len(BLOOD_TYPES)) if mask >> code & 1]
+
+
+def is_rare_blood_type(blood_type):
+    return bool(RARE_BLOOD_MASK >> BLOOD_CODES[blood_type] & 1)
+
+
+class DonorBuckets:
+    """Available donors bucketed by blood type, each bucket with its own grid index
+
+    A request only visits the buckets set in its recipient mask, so incompatible
+    donors are never looked at.
+    """
+
+    def __init__(self, cell_km=5.0):
+        self._buckets = [GridIndex(cell_km) for _ in BLOOD_TYPES]
+        self._bucket_of = {}
+
+    def __len__(self):
+        return len(self._bucket_of)
+
+    def __contains__(self, row):
+        return row in self._bucket_of
+
+    def add(self, row, blood_code, lat, lon):
+        """Put an available donor row in its blood-type bucket"""
+        self.remove(row)
+        self._buckets[blood_code].add(row, lat, lon)
+        self._bucket_of[row] = blood_code
+
+    def add_many(self, rows, blood_codes, lats, lons):
+        """Put a batch of available donor rows, not yet bucketed, in their buckets"""
+        rows, blood_codes = np.asarray(rows), np.asarray(blood_codes)
+        lats, lons = np.asarray(lats), np.asarray(lons)
+        for code in np.unique(blood_codes).tolist():
+            members = blood_codes == code
+            self._buckets[code].add_many(rows[members], lats[members], lons[members])
+        self._bucket_of.update(zip(rows.tolist(), blood_codes.tolist()))
+
+    def regrid(self, cell_km, latitudes, longitudes):
+        """Independent copy with a different cell size; coordinates indexed by row"""
+        buckets = DonorBuckets(cell_km)
+        rows = np.fromiter(self._bucket_of, dtype=np.int64, count=len(self._bucket_of))
+        codes = np.fromiter(self._bucket_of.values(), dtype=np.int64, count=len(rows))
+        buckets.add_many(rows, codes, latitudes[rows], longitudes[rows])
+        return buckets
+
+    def remove(self, row):
+        code = self._bucket_of.pop(row, None)
+        if code is not None:
+            self._buckets[code].remove(row)
+
+    def count(self, mask):
+        """Available donors across the buckets in a mask"""
+        return sum(len(self._buckets[code]) for code in mask_codes(mask))
+
+    def query(self, mask, lat, lon, radius_km):
+        """Candidate rows near a point from the buckets in a mask"""
+        candidates = []
+        for code in mask_codes(mask):
+            candidates.extend(self._buckets[code].query(lat, lon, radius_km))
+        return candidates
+
+    def nearest(self, mask, lat, lon, k, latitudes, longitudes, start_km=5.0, max_km=50.0, exact=True):
+        """Up to k nearest rows from the buckets in a mask, searching outward
+
+        The search radius starts at start_km and doubles until k donors are
+        known to lie inside it or max_km is reached, so distances are only
+        computed for the rings actually visited. latitudes and longitudes are
+        the coordinate columns indexed by row. With exact=False the haversine
+        distances and order are returned without geodesic refinement. Returns
+        (rows, distances_km, radius_km searched).
+        """
+        codes = mask_codes(mask)
+        grid = self._buckets[0]
+        visited = set()
+        rows = np.empty(0, dtype=np.int64)
+        dist = np.empty(0)
+        radius = min(start_km, max_km)
+        error = HAVERSINE_REL_ERROR if exact else 0.0
+        while True:
+            # Only cells not covered by a smaller ring
+            ring = [cell for cell in grid.cells_within(lat, lon, radius) if cell not in visited]
+            visited.update(ring)
+            new = np.array([row for code in codes for row in self._buckets[code].rows_in(ring)],
+                           dtype=np.int64)
+            rows = np.concatenate([rows, new])
+            dist = np.concatenate([dist, haversine_km(lat, lon, latitudes[new], longitudes[new])])
+            # Enough donors inside the radius whatever haversine's error
+            if np.count_nonzero(dist <= radius * (1 - error)) >= k or radius >= max_km:
+                break
+            radius = min(radius * 2, max_km)
+        if not exact:
+            inside = np.flatnonzero(dist <= radius)
+            if len(inside) > k:
+                inside = inside[np.argpartition(dist[inside], k - 1)[:k]]
+            inside = inside[np.argsort(dist[inside], kind='stable')]
+            return rows[inside], dist[inside], radius
+        positions, distances = distances_within(
+            lat, lon, latitudes[rows], longitudes[rows], radius, limit=k
+        )
+        return rows[positions], distances, radius
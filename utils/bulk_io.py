@@ -0,0 +1,194 @@
+"""Streaming donor import and export in CSV or Parquet
+
+pandas and pyarrow are imported inside the functions that use them, so pages
+can list FORMATS without paying for either library.
+"""
+import uuid
+
+import numpy as np
+
+from utils.donor_store import BLOOD_TYPES, STATUSES, from_epoch
+
+FORMATS = ['csv', 'parquet']
+# Rows held in memory at once while importing or exporting
+CHUNK_ROWS = 50_000
+REQUIRED_COLUMNS = ['name', 'blood_type', 'phone', 'location', 'latitude', 'longitude']
+# Optional when a geocoder is given: blank coordinates are looked up from location
+COORDINATE_COLUMNS = ['latitude', 'longitude']
+EXPORT_COLUMNS = ['id', 'name', 'blood_type', 'phone', 'location', 'latitude', 'longitude',
+                  'status', 'last_donation', 'points', 'badges']
+# Optional leading +, then 7-15 digits with spaces or dashes between groups
+PHONE_PATTERN = r'\+?\d[\d\s-]{5,18}\d'
+BADGE_SEPARATOR = ';'
+# Largest points value the in-memory points column holds
+MAX_POINTS = np.iinfo(np.int32).max
+
+
+def read_chunks(source, fmt, chunk_rows=CHUNK_ROWS):
+    """DataFrames of at most chunk_rows rows read lazily from a file or path"""
+    import pandas as pd
+    import pyarrow.parquet as pq
+    if fmt == 'csv':
+        yield from pd.read_csv(source, chunksize=chunk_rows, dtype=str, keep_default_na=False)
+    elif fmt == 'parquet':
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _text(frame, column, default=''):
+    import pandas as pd
+    if column not in frame.columns:
+        return pd.Series(default, index=frame.index, dtype='string')
+    return frame[column].astype('string').fillna('').str.strip()
+
+
+def _coordinate(frame, column):
+    import pandas as pd
+    if column not in frame.columns:
+        return pd.Series(np.nan, index=frame.index, dtype=float)
+    return pd.to_numeric(frame[column], errors='coerce').astype(float)
+
+
+def validate_chunk(frame, geocode=None):
+    """Split a chunk into donor dicts and a frame of rejected rows with the reason
+
+    Every check is one vectorised operation over the chunk; a row is rejected
+    for the first check it fails. With geocode, rows without coordinates are
+    placed from their location text, each distinct location looked up once.
+    """
+    import pandas as pd
+    required = [column for column in REQUIRED_COLUMNS
+                if geocode is None or column not in COORDINATE_COLUMNS]
+    missing = [column for column in required if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    name = _text(frame, 'name')
+    blood_type = _text(frame, 'blood_type').str.upper()
+    phone = _text(frame, 'phone')
+    location = _text(frame, 'location')
+    latitude = _coordinate(frame, 'latitude')
+    longitude = _coordinate(frame, 'longitude')
+    unplaced = pd.Series(False, index=frame.index)
+    if geocode is not None:
+        blank = (latitude.isna() | longitude.isna()) & (location != '')
+        places = {text: geocode(text) for text in location[blank].unique()}
+        found = location[blank].map(places)
+        unplaced = blank & found.reindex(frame.index).isna()
+        found = found.dropna()
+        latitude[found.index] = [place['latitude'] for place in found]
+        longitude[found.index] = [place['longitude'] for place in found]
+    status = _text(frame, 'status', 'Available').replace('', 'Available').str.title()
+    points = pd.to_numeric(_text(frame, 'points', '0').replace('', '0'), errors='coerce').astype(float)
+    donated = _text(frame, 'last_donation')
+    last_donation = pd.to_datetime(donated, errors='coerce')
+
+    checks = [
+        (name == '', "missing name"),
+        (~blood_type.isin(BLOOD_TYPES), "invalid blood type"),
+        (~phone.str.fullmatch(PHONE_PATTERN).fillna(False).astype(bool), "invalid phone"),
+        (location == '', "missing location"),
+        (unplaced, "location not found"),
+        (~latitude.between(-90, 90), "invalid latitude"),
+        (~longitude.between(-180, 180), "invalid longitude"),
+        (~status.isin(STATUSES), "invalid status"),
+        (~(points.between(0, MAX_POINTS) & (points == np.floor(points))), "invalid points"),
+        ((donated != '') & last_donation.isna(), "invalid last donation date"),
+    ]
+    rejected = np.zeros(len(frame), dtype=bool)
+    reasons = np.full(len(frame), '', dtype=object)
+    for failed, reason in checks:
+        failed = failed.to_numpy(dtype=bool, na_value=True)
+        reasons[failed & ~rejected] = reason
+        rejected |= failed
+
+    valid = ~rejected
+    ids = _text(frame, 'id')[valid].tolist()
+    badges = _text(frame, 'badges')[valid].tolist()
+    last_donation = pd.DatetimeIndex(last_donation[valid]).to_pydatetime()
+    donors = [
+        {
+            'id': donor_id or str(uuid.uuid4()),
+            'name': n, 'blood_type': b, 'phone': p, 'location': loc,
+            'latitude': lat, 'longitude': lon, 'status': s,
+            'last_donation': None if pd.isna(when) else when,
+            'points': int(pts),
+            'badges': [badge for badge in badge_text.split(BADGE_SEPARATOR) if badge],
+        }
+        for donor_id, n, b, p, loc, lat, lon, s, when, pts, badge_text in zip(
+            ids, name[valid].tolist(), blood_type[valid].tolist(), phone[valid].tolist(),
+            location[valid].tolist(), latitude[valid].tolist(), longitude[valid].tolist(),
+            status[valid].tolist(), last_donation, points[valid].tolist(), badges
+        )
+    ]
+    errors = frame[rejected].assign(error=reasons[rejected])
+    return donors, errors
+
+
+def import_donors(source, fmt, write, chunk_rows=CHUNK_ROWS, max_errors=100, geocode=None):
+    """Validate a donor file chunk by chunk, passing each chunk's donors to write
+
+    Returns (imported count, rejected count, frame of the first max_errors
+    rejected rows). Only one chunk is held in memory at a time. geocode, if
+    given, places rows whose latitude and longitude are blank or absent.
+    """
+    import pandas as pd
+    imported = rejected = 0
+    error_frames = []
+    kept = 0
+    for frame in read_chunks(source, fmt, chunk_rows):
+        donors, errors = validate_chunk(frame, geocode)
+        if donors:
+            write(donors)
+        imported += len(donors)
+        rejected += len(errors)
+        if kept < max_errors and len(errors):
+            error_frames.append(errors.head(max_errors - kept))
+            kept += len(error_frames[-1])
+    errors = pd.concat(error_frames) if error_frames else pd.DataFrame(columns=REQUIRED_COLUMNS + ['error'])
+    return imported, rejected, errors
+
+
+def donor_frame(store, start, stop):
+    """Export columns for store rows start..stop, built from the typed columns"""
+    import pandas as pd
+    rows = slice(start, stop)
+    badge_text = np.array([BADGE_SEPARATOR.join(badges) for badges in store.badge_sets.values] or [''],
+                          dtype=object)
+    return pd.DataFrame({
+        'id': store.ids[rows],
+        'name': store.names[rows],
+        'blood_type': np.array(BLOOD_TYPES, dtype=object)[store.column('blood_code')[rows]],
+        'phone': store.phones[rows],
+        'location': np.array(store.locations.values, dtype=object)[store.column('location_code')[rows]],
+        'latitude': store.column('latitude')[rows],
+        'longitude': store.column('longitude')[rows],
+        'status': np.array(STATUSES, dtype=object)[store.column('status_code')[rows]],
+        'last_donation': pd.to_datetime([from_epoch(v) for v in store.column('last_donation')[rows]]),
+        'points': store.column('points')[rows],
+        'badges': badge_text[store.column('badges_code')[rows]],
+    }, columns=EXPORT_COLUMNS)
+
+
+def export_donors(store, target, fmt, chunk_rows=CHUNK_ROWS):
+    """Write every donor in the store to a binary file, one chunk at a time"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    try:
+        for start in range(0, max(len(store), 1), chunk_rows):
+            frame = donor_frame(store, start, min(start + chunk_rows, len(store)))
+            if fmt == 'csv':
+                target.write(frame.to_csv(index=False, header=start == 0).encode())
+            else:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(target, table.schema)
+                writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
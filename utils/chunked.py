@@ -0,0 +1,219 @@
+"""Copy-on-write containers split into chunks
+
+Copying one copies only its list of chunks. A chunk is duplicated when the copy
+(or the original) first changes it, so a write after a copy costs the size of
+one chunk rather than of the whole container.
+"""
+import bisect
+import itertools
+
+# Hash buckets in a ChunkedDict
+DICT_CHUNKS = 256
+# Items per chunk of a ChunkedList; ChunkedSortedList chunks split at twice this
+LIST_CHUNK = 512
+
+# Shared by every unused bucket, and copied before anything is put in it
+_EMPTY = {}
+
+
+class ChunkedDict:
+    """Mapping spread over a fixed number of hash buckets"""
+
+    def __init__(self):
+        self._chunks = [_EMPTY] * DICT_CHUNKS
+        # Buckets this dict may change in place
+        self._owned = [False] * DICT_CHUNKS
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        return key in self._chunks[hash(key) % DICT_CHUNKS]
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __getitem__(self, key):
+        return self._chunks[hash(key) % DICT_CHUNKS][key]
+
+    def get(self, key, default=None):
+        return self._chunks[hash(key) % DICT_CHUNKS].get(key, default)
+
+    def values(self):
+        for chunk in self._chunks:
+            yield from chunk.values()
+
+    def items(self):
+        for chunk in self._chunks:
+            yield from chunk.items()
+
+    def copy(self):
+        """A dict that can change without changing this one, sharing every bucket until either changes it"""
+        other = ChunkedDict.__new__(ChunkedDict)
+        other._chunks = list(self._chunks)
+        other._owned = [False] * DICT_CHUNKS
+        other._len = self._len
+        self._owned = [False] * DICT_CHUNKS
+        return other
+
+    def _chunk(self, key):
+        """The bucket for key, safe to change in place"""
+        i = hash(key) % DICT_CHUNKS
+        if not self._owned[i]:
+            self._chunks[i] = dict(self._chunks[i])
+            self._owned[i] = True
+        return self._chunks[i]
+
+    def __setitem__(self, key, value):
+        chunk = self._chunk(key)
+        self._len += key not in chunk
+        chunk[key] = value
+
+    def __delitem__(self, key):
+        del self._chunk(key)[key]
+        self._len -= 1
+
+    def pop(self, key, default=None):
+        if key not in self:
+            return default
+        self._len -= 1
+        return self._chunk(key).pop(key)
+
+    def update(self, items):
+        """Set a batch of (key, value) pairs"""
+        chunks, owned = self._chunks, self._owned
+        for key, value in items:
+            i = hash(key) % DICT_CHUNKS
+            if not owned[i]:
+                chunks[i] = dict(chunks[i])
+                owned[i] = True
+            chunks[i][key] = value
+        self._len = sum(map(len, chunks))
+
+
+class ChunkedList:
+    """Append-only list in fixed-size chunks whose items can be replaced by position"""
+
+    def __init__(self):
+        self._chunks = []
+        self._owned = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __getitem__(self, position):
+        return self._chunks[position // LIST_CHUNK][position % LIST_CHUNK]
+
+    def copy(self):
+        other = ChunkedList()
+        other._chunks = list(self._chunks)
+        other._owned = [False] * len(self._chunks)
+        other._len = self._len
+        self._owned = [False] * len(self._chunks)
+        return other
+
+    def _own(self, i):
+        if not self._owned[i]:
+            self._chunks[i] = list(self._chunks[i])
+            self._owned[i] = True
+        return self._chunks[i]
+
+    def __setitem__(self, position, item):
+        self._own(position // LIST_CHUNK)[position % LIST_CHUNK] = item
+
+    def append(self, item):
+        if not self._chunks or len(self._chunks[-1]) == LIST_CHUNK:
+            self._chunks.append([])
+            self._owned.append(True)
+        self._own(len(self._chunks) - 1).append(item)
+        self._len += 1
+
+
+class ChunkedSortedList:
+    """Sorted keys in consecutive sorted chunks, with the largest key of each
+
+    Adding or removing a key bisects the chunk maxima, then the one chunk.
+    """
+
+    def __init__(self, keys=()):
+        self._fill(sorted(keys))
+
+    def _fill(self, keys):
+        self._chunks = [keys[i:i + LIST_CHUNK] for i in range(0, len(keys), LIST_CHUNK)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._owned = [True] * len(self._chunks)
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def copy(self):
+        other = ChunkedSortedList()
+        other._chunks = list(self._chunks)
+        other._maxes = list(self._maxes)
+        other._owned = [False] * len(self._chunks)
+        other._len = self._len
+        self._owned = [False] * len(self._chunks)
+        return other
+
+    def _own(self, i):
+        if not self._owned[i]:
+            self._chunks[i] = list(self._chunks[i])
+            self._owned[i] = True
+        return self._chunks[i]
+
+    def add(self, key):
+        self._len += 1
+        if not self._chunks:
+            self._chunks, self._maxes, self._owned = [[key]], [key], [True]
+            return
+        i = min(bisect.bisect_left(self._maxes, key), len(self._chunks) - 1)
+        chunk = self._own(i)
+        bisect.insort(chunk, key)
+        self._maxes[i] = chunk[-1]
+        if len(chunk) > 2 * LIST_CHUNK:
+            self._chunks[i:i + 1] = [chunk[:LIST_CHUNK], chunk[LIST_CHUNK:]]
+            self._maxes[i:i + 1] = [chunk[LIST_CHUNK - 1], chunk[-1]]
+            self._owned[i:i + 1] = [True, True]
+
+    def update(self, keys):
+        """Add a batch of keys with one sort of the whole list"""
+        self._fill(sorted(itertools.chain(*self._chunks, keys)))
+
+    def remove(self, key):
+        """Remove a key that is in the list"""
+        i = bisect.bisect_left(self._maxes, key)
+        chunk = self._own(i)
+        del chunk[bisect.bisect_left(chunk, key)]
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i], self._maxes[i], self._owned[i]
+        self._len -= 1
+
+    def index(self, key):
+        """Number of keys less than key"""
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._chunks):
+            return self._len
+        return sum(map(len, self._chunks[:i])) + bisect.bisect_left(self._chunks[i], key)
+
+    def head(self, k):
+        """The k smallest keys"""
+        keys = []
+        for chunk in self._chunks:
+            if len(keys) >= k:
+                break
+            keys.extend(chunk[:k - len(keys)])
+        return keys
@@ -0,0 +1,372 @@
+"""SQLite persistence for donors, requests, donations and notifications"""
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+DEFAULT_PATH = os.environ.get('BLOODCONNECT_DB', 'bloodconnect.db')
+# Size of the rounded-coordinate buckets stored with each donor, in degrees
+CELL_DEG = 0.05
+KM_PER_DEGREE = 110.574
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS donors (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    blood_type TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    location TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    cell_lat INTEGER NOT NULL,
+    cell_lon INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    last_donation REAL,
+    points INTEGER NOT NULL DEFAULT 0,
+    badges TEXT NOT NULL DEFAULT '[]',
+    extra TEXT NOT NULL DEFAULT '{}',
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_donors_match ON donors (blood_type, status, cell_lat, cell_lon);
+CREATE INDEX IF NOT EXISTS idx_donors_status ON donors (status);
+CREATE INDEX IF NOT EXISTS idx_donors_last_donation ON donors (last_donation);
+CREATE INDEX IF NOT EXISTS idx_donors_cell ON donors (cell_lat, cell_lon);
+
+CREATE TABLE IF NOT EXISTS requests (
+    id TEXT PRIMARY KEY,
+    blood_type TEXT NOT NULL,
+    urgency TEXT NOT NULL,
+    status TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_requests_status ON requests (status, urgency);
+
+CREATE TABLE IF NOT EXISTS donations (
+    id TEXT PRIMARY KEY,
+    donor_id TEXT NOT NULL,
+    request_id TEXT,
+    donated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_donations_donor ON donations (donor_id, donated_at);
+
+CREATE TABLE IF NOT EXISTS notifications (
+    id TEXT PRIMARY KEY,
+    donor_id TEXT NOT NULL,
+    request_id TEXT,
+    timestamp REAL NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_donor ON notifications (donor_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_notifications_request ON notifications (request_id);
+
+CREATE TABLE IF NOT EXISTS responses (
+    request_id TEXT NOT NULL,
+    donor_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    responded_at REAL NOT NULL,
+    UNIQUE (request_id, donor_id)
+);
+"""
+
+
+# Each write to a donor row gives it the next revision, so readers can load
+# added and changed rows in the order they were written
+NEXT_REVISION = "(SELECT COALESCE(MAX(revision), 0) + 1 FROM donors)"
+
+
+def _upsert(table, columns, computed=None):
+    """Prepared insert that updates in place on id conflicts (keeping the rowid)
+
+    computed maps further columns to SQL expressions evaluated for each row.
+    """
+    computed = computed or {}
+    names = columns + list(computed)
+    values = [':' + c for c in columns] + list(computed.values())
+    return "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT(id) DO UPDATE SET {}".format(
+        table, ', '.join(names), ', '.join(values),
+        ', '.join('{0} = excluded.{0}'.format(c) for c in names if c != 'id'))
+
+
+INSERT_DONOR = _upsert('donors', ['id', 'name', 'blood_type', 'phone', 'location', 'latitude',
+                                  'longitude', 'cell_lat', 'cell_lon', 'status', 'last_donation',
+                                  'points', 'badges', 'extra'], {'revision': NEXT_REVISION})
+UPDATE_DONOR_STATUS = f"UPDATE donors SET status = ?, revision = {NEXT_REVISION} WHERE id = ?"
+UPDATE_DONOR_POINTS = f"UPDATE donors SET points = ?, revision = {NEXT_REVISION} WHERE id = ?"
+INSERT_REQUEST = _upsert('requests', ['id', 'blood_type', 'urgency', 'status', 'latitude',
+                                      'longitude', 'created_at', 'data'])
+INSERT_DONATION = _upsert('donations', ['id', 'donor_id', 'request_id', 'donated_at', 'data'])
+INSERT_NOTIFICATION = _upsert('notifications', ['id', 'donor_id', 'request_id', 'timestamp',
+                                                'status', 'message'])
+
+# A donor's first response to a request stands; later clicks change nothing
+INSERT_RESPONSE = ("INSERT INTO responses (request_id, donor_id, status, responded_at)"
+                   " VALUES (?, ?, ?, ?) ON CONFLICT (request_id, donor_id) DO NOTHING")
+
+DONOR_FIELDS = {'id', 'name', 'blood_type', 'phone', 'location', 'latitude', 'longitude',
+                'status', 'last_donation', 'points', 'badges'}
+
+
+def _epoch(value):
+    return None if value is None else value.timestamp()
+
+
+def _datetime(value):
+    return None if value is None else datetime.fromtimestamp(value)
+
+
+def _encode(value):
+    """JSON with datetimes tagged so they round-trip"""
+    if not value:
+        return '{}'
+    return json.dumps(value, default=lambda v: {'$dt': v.timestamp()})
+
+
+_DECODER = json.JSONDecoder(object_hook=lambda d: _datetime(d['$dt']) if '$dt' in d else d)
+
+
+def _decode(text):
+    # Most bulk-imported donors have no extra fields
+    return {} if text == '{}' else _DECODER.decode(text)
+
+
+def _request_data(request):
+    # Responses live in their own table so concurrent ones never overwrite each other
+    return _encode({k: v for k, v in request.items() if k != 'responses'})
+
+
+def _request(text):
+    request = _decode(text)
+    request['responses'] = []
+    return request
+
+
+def cell(value):
+    return math.floor(value / CELL_DEG)
+
+
+def _migrate(conn):
+    """Bring a database written by an earlier version up to SCHEMA"""
+    if 'revision' not in {column['name'] for column in conn.execute("PRAGMA table_info(donors)")}:
+        with conn:
+            conn.execute("ALTER TABLE donors ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+            # Existing donors keep the order they were stored in
+            conn.execute("UPDATE donors SET revision = rowid")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_revision ON donors (revision)")
+
+
+class ConnectionPool:
+    """Fixed set of SQLite connections shared between threads"""
+
+    def __init__(self, path, size=4):
+        self._idle = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+
+class Database:
+    """Indexed SQLite store in WAL mode; reads share a pool, writes are serialised"""
+
+    def __init__(self, path=DEFAULT_PATH, pool_size=4):
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        self._write_lock = threading.Lock()
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+            _migrate(conn)
+
+    def _write(self, sql, rows):
+        with self._write_lock, self.pool.connection() as conn:
+            with conn:
+                conn.executemany(sql, rows)
+
+    def _read(self, sql, params=()):
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    # Donors
+    def insert_donors(self, donors):
+        """Insert or update a batch of donor dicts with one prepared statement"""
+        self._write(INSERT_DONOR, (
+            {
+                'id': d['id'], 'name': d['name'], 'blood_type': d['blood_type'], 'phone': d['phone'],
+                'location': d['location'], 'latitude': d['latitude'], 'longitude': d['longitude'],
+                'cell_lat': cell(d['latitude']), 'cell_lon': cell(d['longitude']),
+                'status': d['status'], 'last_donation': _epoch(d['last_donation']),
+                'points': d['points'], 'badges': json.dumps(d['badges']),
+                'extra': _encode({k: v for k, v in d.items() if k not in DONOR_FIELDS}),
+            }
+            for d in donors
+        ))
+
+    def update_donor_status(self, donor_id, status):
+        self._write(UPDATE_DONOR_STATUS, [(status, donor_id)])
+
+    def update_donor_points(self, donor_id, points):
+        self._write(UPDATE_DONOR_POINTS, [(points, donor_id)])
+
+    def _donor(self, row):
+        donor = {
+            'id': row['id'], 'name': row['name'], 'blood_type': row['blood_type'],
+            'phone': row['phone'], 'location': row['location'],
+            'latitude': row['latitude'], 'longitude': row['longitude'],
+            'status': row['status'], 'last_donation': _datetime(row['last_donation']),
+            'points': row['points'], 'badges': json.loads(row['badges']),
+        }
+        donor.update(_decode(row['extra']))
+        return donor
+
+    def load_donors(self, after=0, limit=None):
+        """(revision, donor) pairs for donors added or changed after the given revision, at most limit"""
+        rows = self._read("SELECT * FROM donors WHERE revision > ? ORDER BY revision LIMIT ?",
+                          (after, -1 if limit is None else limit))
+        return [(row['revision'], self._donor(row)) for row in rows]
+
+    def find_candidates(self, blood_types, lat, lon, radius_km, donated_before=None, limit=None):
+        """Available donors of the given types in the cells around a point
+
+        Blood type, status, spatial bucket and deferral filters run in SQL on
+        the indexes; callers check exact distance on the returned rows. With a
+        limit, only the nearest donors by flat-earth distance are returned.
+
+        The escalation scheduler matches through this, so background re-matching
+        never holds donors in memory. Interactive matching deliberately does not:
+        MatchingEngine answers from in-memory blood-type buckets, about 2 ms per
+        request against about 80 ms for this query at 100k donors, and reads
+        the donor columns the app already holds for Find Donors.
+        """
+        dlat = radius_km / KM_PER_DEGREE
+        dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(min(abs(lat) + dlat, 89.9))))
+        sql = ("SELECT * FROM donors WHERE blood_type IN ({}) AND status = 'Available'"
+               " AND cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ?"
+               .format(', '.join('?' * len(blood_types))))
+        params = list(blood_types) + [cell(lat - dlat), cell(lat + dlat), cell(lon - dlon), cell(lon + dlon)]
+        if donated_before is not None:
+            sql += " AND (last_donation IS NULL OR last_donation <= ?)"
+            params.append(_epoch(donated_before))
+        if limit is not None:
+            # Ordering only, so the squared equirectangular distance is enough
+            scale = math.cos(math.radians(lat))
+            sql += (" ORDER BY (latitude - ?) * (latitude - ?)"
+                    " + (longitude - ?) * (longitude - ?) * ? LIMIT ?")
+            params += [lat, lat, lon, lon, scale * scale, limit]
+        return [self._donor(row) for row in self._read(sql, params)]
+
+    # Requests
+    def insert_request(self, request):
+        self.insert_requests([request])
+
+    def insert_requests(self, requests):
+        """Insert or update a batch of requests in one transaction"""
+        self._write(INSERT_REQUEST, (
+            {
+                'id': request['id'], 'blood_type': request['blood_type'], 'urgency': request['urgency'],
+                'status': request['status'], 'latitude': request['latitude'],
+                'longitude': request['longitude'], 'created_at': _epoch(request['created_at']),
+                'data': _request_data(request),
+            }
+            for request in requests
+        ))
+
+    def load_request(self, request_id):
+        rows = self._read("SELECT data FROM requests WHERE id = ?", (request_id,))
+        return _request(rows[0]['data']) if rows else None
+
+    def transition_request(self, request, status, from_status):
+        """Move a request to status only if it is still in from_status; True if it was"""
+        request = dict(request, status=status)
+        with self._write_lock, self.pool.connection() as conn:
+            with conn:
+                cursor = conn.execute(
+                    "UPDATE requests SET status = ?, data = ? WHERE id = ? AND status = ?",
+                    (status, _request_data(request), request['id'], from_status)
+                )
+        return cursor.rowcount == 1
+
+    def load_requests(self, after=0):
+        rows = self._read("SELECT rowid, data FROM requests WHERE rowid > ? ORDER BY rowid", (after,))
+        return [(row['rowid'], _request(row['data'])) for row in rows]
+
+    def add_response(self, response):
+        """Record a donor's response to a request in one atomic insert
+
+        Returns False if the donor had already responded to that request.
+        """
+        with self._write_lock, self.pool.connection() as conn:
+            with conn:
+                cursor = conn.execute(INSERT_RESPONSE, (
+                    response['request_id'], response['donor_id'], response['status'],
+                    _epoch(response['responded_at'])
+                ))
+        return cursor.rowcount == 1
+
+    def load_responses(self, after=0):
+        rows = self._read("SELECT rowid, * FROM responses WHERE rowid > ? ORDER BY rowid", (after,))
+        return [
+            (row['rowid'], {
+                'request_id': row['request_id'], 'donor_id': row['donor_id'],
+                'status': row['status'], 'responded_at': _datetime(row['responded_at']),
+            })
+            for row in rows
+        ]
+
+    # Donations
+    def insert_donation(self, donation):
+        self._write(INSERT_DONATION, [{
+            'id': donation['id'], 'donor_id': donation['donor_id'],
+            'request_id': donation.get('request_id'), 'donated_at': _epoch(donation['donated_at']),
+            'data': _encode(donation),
+        }])
+
+    def load_donations(self, after=0):
+        rows = self._read("SELECT rowid, data FROM donations WHERE rowid > ? ORDER BY rowid", (after,))
+        return [(row['rowid'], _decode(row['data'])) for row in rows]
+
+    # Notifications
+    def insert_notifications(self, notifications):
+        self._write(INSERT_NOTIFICATION, (
+            {
+                'id': n['id'], 'donor_id': n['donor_id'], 'request_id': n['request_id'],
+                'timestamp': _epoch(n['timestamp']), 'status': n['status'], 'message': n['message'],
+            }
+            for n in notifications
+        ))
+
+    def update_notification_status(self, notification_id, status):
+        self._write("UPDATE notifications SET status = ? WHERE id = ?", [(status, notification_id)])
+
+    def notified_donors(self, request_id):
+        """Ids of every donor already notified about a request"""
+        rows = self._read("SELECT donor_id FROM notifications WHERE request_id = ?", (request_id,))
+        return {row['donor_id'] for row in rows}
+
+    def load_notifications(self, after=0):
+        rows = self._read("SELECT rowid, * FROM notifications WHERE rowid > ? ORDER BY rowid", (after,))
+        return [
+            (row['rowid'], {
+                'id': row['id'], 'donor_id': row['donor_id'], 'message': row['message'],
+                'timestamp': _datetime(row['timestamp']), 'request_id': row['request_id'],
+                'status': row['status'],
+            })
+            for row in rows
+        ]
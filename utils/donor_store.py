@@ -0,0 +1,238 @@
+"""Columnar donor table backed by NumPy arrays"""
+from datetime import datetime
+
+import numpy as np
+
+BLOOD_TYPES = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+STATUSES = ['Available', 'Unavailable']
+AVAILABLE = 0
+# last_donation epoch for donors who have never donated
+NEVER = -1
+
+BLOOD_CODES = {blood_type: code for code, blood_type in enumerate(BLOOD_TYPES)}
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+COLUMNS = {
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'points': np.int32,
+    'blood_code': np.int8,
+    'status_code': np.int8,
+    'last_donation': np.int64,
+    'location_code': np.int32,
+    'badges_code': np.int32,
+}
+
+# Fields with their own column or side table; anything else goes to extras
+CORE_FIELDS = {'id', 'name', 'phone', 'location', 'latitude', 'longitude', 'blood_type',
+               'status', 'points', 'last_donation', 'badges'}
+
+
+def to_epoch(value):
+    """Seconds since the epoch for a datetime, NEVER for None"""
+    return NEVER if value is None else int(value.timestamp())
+
+
+def from_epoch(value):
+    """Inverse of to_epoch"""
+    return None if value == NEVER else datetime.fromtimestamp(int(value))
+
+
+class Categories:
+    """Interned strings (or tuples) stored once and referenced by integer code"""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class DonorStore:
+    """Donor table with one typed array per numeric field and side tables for strings
+
+    Rows are append-only, so a row number identifies a donor for the lifetime of
+    the store. Filtering and sorting work on the column views and return row
+    numbers; dicts are only built for the rows that are actually displayed.
+    version increases with every change, for caching derived results.
+    """
+
+    def __init__(self, capacity=1024):
+        self._n = 0
+        self.version = 0
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        # Columns, and the names, phones and extras, whose storage is shared with
+        # the store this one was copied from
+        self._shared = set()
+        self._shared_lists = set()
+        self.ids = []
+        self.names = []
+        self.phones = []
+        self.extras = {}
+        self.locations = Categories()
+        self.badge_sets = Categories()
+        self._rows = {}
+
+    def __len__(self):
+        return self._n
+
+    def column(self, name):
+        """View of a numeric column over the stored rows"""
+        return self._columns[name][:self._n]
+
+    def row_of(self, donor_id):
+        row = self._rows.get(donor_id)
+        # Copies share the id index, which may already hold rows added after this one
+        return row if row is not None and row < self._n else None
+
+    def copy(self):
+        """A store that can change without changing this one, sharing its storage
+
+        Rows are append-only and each store reads only its first len() rows, so
+        the copy appends into the same arrays and lists. A column is duplicated
+        only when the copy first changes an existing row of it.
+        """
+        if len(self.ids) > self._n:
+            # Drop what a discarded earlier copy appended past the shared rows
+            for donor_id in self.ids[self._n:]:
+                self._rows.pop(donor_id, None)
+            for row in [row for row in self.extras if row >= self._n]:
+                del self.extras[row]
+            del self.ids[self._n:], self.names[self._n:], self.phones[self._n:]
+        store = DonorStore.__new__(DonorStore)
+        store.__dict__.update(self.__dict__)
+        store._columns = dict(self._columns)
+        store._shared = set(COLUMNS)
+        store._shared_lists = {'names', 'phones', 'extras'}
+        return store
+
+    def _own(self, name):
+        if name in self._shared:
+            self._columns[name] = self._columns[name].copy()
+            self._shared.discard(name)
+        return self._columns[name]
+
+    def _reserve(self, extra):
+        capacity = len(self._columns['points'])
+        needed = self._n + extra
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, array in self._columns.items():
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self._n] = array[:self._n]
+            self._columns[name] = grown
+        self._shared.clear()
+
+    def _own_list(self, name):
+        """names, phones or extras, safe to change at existing rows"""
+        if name in self._shared_lists:
+            value = getattr(self, name)
+            setattr(self, name, dict(value) if name == 'extras' else value[:self._n])
+            self._shared_lists.discard(name)
+        return getattr(self, name)
+
+    def _values(self, donor):
+        """A donor dict's value for each numeric column"""
+        return {
+            'latitude': donor['latitude'],
+            'longitude': donor['longitude'],
+            'points': donor['points'],
+            'blood_code': BLOOD_CODES[donor['blood_type']],
+            'status_code': STATUS_CODES[donor['status']],
+            'last_donation': to_epoch(donor['last_donation']),
+            'location_code': self.locations.code(donor['location']),
+            'badges_code': self.badge_sets.code(tuple(donor['badges'])),
+        }
+
+    def extend(self, donors):
+        """Add a batch of donor dicts column by column and return their rows"""
+        count = len(donors)
+        self._reserve(count)
+        start = self._n
+        locations, badge_sets = self.locations, self.badge_sets
+        values = {
+            'latitude': [d['latitude'] for d in donors],
+            'longitude': [d['longitude'] for d in donors],
+            'points': [d['points'] for d in donors],
+            'blood_code': [BLOOD_CODES[d['blood_type']] for d in donors],
+            'status_code': [STATUS_CODES[d['status']] for d in donors],
+            'last_donation': [to_epoch(d['last_donation']) for d in donors],
+            'location_code': [locations.code(d['location']) for d in donors],
+            'badges_code': [badge_sets.code(tuple(d['badges'])) for d in donors],
+        }
+        for name, column in values.items():
+            self._columns[name][start:start + count] = column
+        for row, donor in enumerate(donors, start):
+            self.ids.append(donor['id'])
+            self.names.append(donor['name'])
+            self.phones.append(donor['phone'])
+            extras = {key: value for key, value in donor.items() if key not in CORE_FIELDS}
+            if extras:
+                self.extras[row] = extras
+            self._rows[donor['id']] = row
+        self._n += count
+        self.version += 1
+        return np.arange(start, start + count)
+
+    def update(self, row, donor):
+        """Overwrite an existing row with a donor dict of the same id; returns whether anything changed"""
+        changed = False
+        for name, value in self._values(donor).items():
+            if self._columns[name][row] != value:
+                self._own(name)[row] = value
+                changed = True
+        for name, value in (('names', donor['name']), ('phones', donor['phone'])):
+            if getattr(self, name)[row] != value:
+                self._own_list(name)[row] = value
+                changed = True
+        extras = {key: value for key, value in donor.items() if key not in CORE_FIELDS}
+        if self.extras.get(row, {}) != extras:
+            self._own_list('extras')[row] = extras
+            changed = True
+        if changed:
+            self.version += 1
+        return changed
+
+    def record(self, row):
+        """Materialise one row as a donor dict"""
+        columns = self._columns
+        donor = {
+            'id': self.ids[row],
+            'name': self.names[row],
+            'blood_type': BLOOD_TYPES[columns['blood_code'][row]],
+            'phone': self.phones[row],
+            'location': self.locations.values[columns['location_code'][row]],
+            'latitude': float(columns['latitude'][row]),
+            'longitude': float(columns['longitude'][row]),
+            'status': STATUSES[columns['status_code'][row]],
+            'last_donation': from_epoch(columns['last_donation'][row]),
+            'points': int(columns['points'][row]),
+            'badges': list(self.badge_sets.values[columns['badges_code'][row]]),
+        }
+        donor.update(self.extras.get(row, {}))
+        return donor
+
+    def records(self, rows):
+        return [self.record(row) for row in rows]
+
+    def set_status(self, row, status):
+        self._own('status_code')[row] = STATUS_CODES[status]
+        self.version += 1
+
+    def add_points(self, row, points):
+        self._own('points')[row] += points
+        self.version += 1
+
+    def set_last_donation(self, row, when):
+        self._own('last_donation')[row] = to_epoch(when)
+        self.version += 1
@@ -0,0 +1,60 @@
+"""Donation deferral: when donors may give blood again"""
+import heapq
+
+import numpy as np
+
+from utils.donor_store import NEVER
+
+# Minimum interval between whole-blood donations
+DEFERRAL_DAYS = 90
+DEFERRAL_SECONDS = DEFERRAL_DAYS * 24 * 60 * 60
+
+
+def next_eligible(last_donation):
+    """Epoch at which a donor may donate again (0 if never donated); works on arrays"""
+    return np.where(np.asarray(last_donation) == NEVER, 0, np.asarray(last_donation) + DEFERRAL_SECONDS)
+
+
+def eligible_mask(last_donation, now):
+    """Rows whose deferral has ended, as a single cutoff comparison"""
+    last_donation = np.asarray(last_donation)
+    return (last_donation == NEVER) | (last_donation <= now - DEFERRAL_SECONDS)
+
+
+class EligibilityIndex:
+    """Deferred donor rows in a heap ordered by next-eligible time
+
+    release() pops every row whose time has come, so donors return to the pool
+    as time passes without rescanning anyone. Re-deferring a row supersedes its
+    earlier entry, which is skipped when it reaches the top.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._until = {}
+
+    def __len__(self):
+        return len(self._until)
+
+    def __contains__(self, row):
+        return row in self._until
+
+    def defer(self, row, until):
+        """Keep a row out of the pool until the given epoch"""
+        self._until[row] = until
+        heapq.heappush(self._heap, (until, row))
+
+    def discard(self, row):
+        """Return a row to the pool; its heap entry is skipped when it reaches the top"""
+        self._until.pop(row, None)
+
+    def release(self, now):
+        """Rows whose deferral ended at or before now, removed from the index"""
+        released = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            until, row = heapq.heappop(heap)
+            if self._until.get(row) == until:
+                del self._until[row]
+                released.append(row)
+        return released
@@ -0,0 +1,305 @@
+"""Headless donor matching and notification, usable without Streamlit
+
+The Streamlit app, the HTTP endpoint in utils.engine_server and the load
+benchmark all drive the same MatchingEngine through its batch calls.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from utils.assignment import DONORS_PER_UNIT, assign_donors
+from utils.blood_matching import DONOR_MASKS, DonorBuckets
+from utils.donor_store import AVAILABLE, STATUSES
+from utils.eligibility import EligibilityIndex, next_eligible
+from utils.instrumentation import Recorder
+from utils.location_utils import distances_within
+from utils.notification_system import new_notification, request_message
+
+# How far the donor search for a request may widen, by urgency (km)
+MAX_SEARCH_RADIUS = {'Critical': 100, 'High': 50, 'Medium': 30, 'Low': 15}
+# Widest search for a match without an urgency (km)
+DEFAULT_MAX_RADIUS = 50
+# First search ring (km), doubled until the nearest donors are known. Small
+# rings keep dense areas cheap; the donors found are the same as from any start
+START_RADIUS = 2
+# Donors returned per request unless it asks for a different number
+MATCH_DONORS = 10
+# Most donors returned per request, whatever it asks for
+MAX_MATCH_DONORS = 500
+# Requests accepted in one batch call
+MAX_BATCH = 1000
+# Fields every submitted request must carry
+REQUEST_FIELDS = ['patient_name', 'blood_type', 'units_needed', 'urgency', 'hospital_name',
+                  'contact', 'location', 'latitude', 'longitude']
+
+
+def _batch(requests):
+    if not isinstance(requests, list) or not all(isinstance(r, dict) for r in requests):
+        raise ValueError("requests must be a list of objects")
+    if len(requests) > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} requests per call")
+    return requests
+
+
+def _query(request):
+    """(blood type, latitude, longitude, donors wanted, widest radius) of a match request"""
+    blood_type = request.get('blood_type')
+    if blood_type not in DONOR_MASKS:
+        raise ValueError(f"Unknown blood type: {blood_type}")
+    try:
+        lat, lon = float(request['latitude']), float(request['longitude'])
+        k = int(request.get('k', MATCH_DONORS))
+    except (KeyError, TypeError, ValueError, OverflowError):
+        # OverflowError: int() of an infinite k, which JSON reads from e.g. 1e400
+        raise ValueError("latitude and longitude must be numbers, and k an integer")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"Coordinates out of range: {lat}, {lon}")
+    urgency = request.get('urgency')
+    if urgency is not None and urgency not in MAX_SEARCH_RADIUS:
+        raise ValueError(f"Unknown urgency: {urgency}")
+    k = min(max(k, 0), MAX_MATCH_DONORS)
+    return blood_type, lat, lon, k, MAX_SEARCH_RADIUS.get(urgency, DEFAULT_MAX_RADIUS)
+
+
+def _new_request(request):
+    """A submitted request, checked and completed as a new Active request
+
+    Any id the caller gave is replaced, so a submission cannot overwrite a
+    stored request.
+    """
+    missing = [field for field in REQUEST_FIELDS if request.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    _query(request)
+    try:
+        units = int(request['units_needed'])
+    except (TypeError, ValueError):
+        raise ValueError("units_needed must be an integer")
+    if units < 1:
+        raise ValueError(f"units_needed must be at least 1, not {units}")
+    created_at = request.get('created_at')
+    return dict(
+        request,
+        id=str(uuid.uuid4()),
+        # Stored as an int, since batch assignment does arithmetic on it
+        units_needed=units,
+        latitude=float(request['latitude']),
+        longitude=float(request['longitude']),
+        status='Active',
+        created_at=created_at if isinstance(created_at, datetime) else datetime.now(),
+        responses=[],
+    )
+
+
+class MatchingEngine:
+    """Available donors indexed for matching, shared by every caller in a process
+
+    Donors are read from a SharedStore, so the engine keeps no copy of them:
+    it indexes rows of the store's latest donors in blood-type buckets with a
+    grid each, leaving out donors who are unavailable or within their deferral.
+    refresh() indexes rows added or changed since it last ran. The indexes are
+    read and written only under one lock; a match holds it for a few
+    milliseconds, while database reads and writes and delivery queueing happen
+    outside it. Matches, distance batches and notification sends are timed
+    on recorder, a fresh Recorder unless one is given.
+    """
+
+    def __init__(self, shared, dispatcher, recorder=None):
+        self.shared = shared
+        self.database = shared.database
+        self.dispatcher = dispatcher
+        self.recorder = recorder or Recorder()
+        self.store = shared.snapshot().donors
+        self.buckets = DonorBuckets()
+        self.eligibility = EligibilityIndex()
+        # Rows of the store indexed so far, and position in its log of changed rows
+        self._rows = 0
+        self._changes = 0
+        self._synced_at = None
+        self._lock = threading.RLock()
+
+    def sync(self, max_age=0.0):
+        """Load what was written to the database since the last sync, unless it ran under max_age seconds ago
+
+        The database is read without the engine's lock, so matches go on meanwhile.
+        """
+        if self._synced_at is not None and time.monotonic() - self._synced_at < max_age:
+            return
+        self.shared.sync()
+        self.refresh()
+        self._synced_at = time.monotonic()
+
+    def refresh(self):
+        """Index donors added or changed in the shared store, and put back those whose deferral ended"""
+        with self._lock:
+            snapshot, changed, self._changes = self.shared.donor_changes(self._changes)
+            self.store = snapshot.donors
+            if changed is None:
+                # Too far behind the store's log of changes to know which rows changed
+                changed = range(self._rows)
+            if len(self.store) > self._rows:
+                self._load_rows(np.arange(self._rows, len(self.store)))
+                self._rows = len(self.store)
+            for row in set(changed):
+                self._defer(row)
+            for row in self.eligibility.release(time.time()):
+                self._refresh(row)
+
+    def stats(self):
+        """Donors known, available to match, and deferred after a donation"""
+        with self._lock:
+            return {'donors': len(self.store), 'matchable': len(self.buckets),
+                    'deferred': len(self.eligibility)}
+
+    def available(self, blood_type):
+        """Donors who can give to a blood type and could be matched now"""
+        with self._lock:
+            return self.buckets.count(DONOR_MASKS[blood_type])
+
+    def set_donor_status(self, donor_id, status):
+        """Change a donor's availability in the database, the shared store and the matching pool"""
+        if status not in STATUSES:
+            raise ValueError(f"Unknown status: {status}")
+        self.shared.set_donor_status(donor_id, status)
+        self.refresh()
+
+    def match(self, requests):
+        """Nearest compatible donors for each of a batch of requests
+
+        Each request needs blood_type, latitude and longitude; its urgency, if
+        given, caps how far the search widens, and k sets how many donors are
+        returned (at most MAX_MATCH_DONORS). Every request is checked before
+        any is matched. Returns one {'donors', 'searched_km'} per request,
+        donors nearest first, each with its distance in km.
+        """
+        queries = [_query(request) for request in _batch(requests)]
+        results = []
+        with self.recorder.timer('match_donors', volume=len(queries)), self._lock:
+            latitudes, longitudes = self.store.column('latitude'), self.store.column('longitude')
+            for blood_type, lat, lon, k, max_km in queries:
+                with self.recorder.timer('nearest_donors') as timing:
+                    rows, distances, searched = self.buckets.nearest(
+                        DONOR_MASKS[blood_type], lat, lon, k, latitudes, longitudes,
+                        start_km=START_RADIUS, max_km=max_km
+                    )
+                    timing.volume = len(rows)
+                results.append({'donors': self._records(rows, distances), 'searched_km': float(searched)})
+        return results
+
+    def within(self, blood_type, lat, lon, radius, limit=None):
+        """Compatible available donors within radius km, nearest first (at most limit)"""
+        with self._lock:
+            rows = np.fromiter(self.buckets.query(DONOR_MASKS[blood_type], lat, lon, radius), dtype=np.int64)
+            with self.recorder.timer('distance_batch', volume=len(rows)):
+                positions, distances = distances_within(
+                    lat, lon, self.store.column('latitude')[rows], self.store.column('longitude')[rows],
+                    radius, limit=limit
+                )
+            return self._records(rows[positions], distances)
+
+    def submit(self, requests):
+        """Store a batch of new blood requests, then notify the nearest donors for each
+
+        Requests are checked and written in one transaction before matching.
+        Returns what match() does, plus the stored 'request' and the
+        'notifications' sent for it.
+        """
+        requests = [_new_request(request) for request in _batch(requests)]
+        self.database.insert_requests(requests)
+        results = self.match(requests)
+        notifications = []
+        for request, result in zip(requests, results):
+            result['request'] = request
+            result['notifications'] = [
+                new_notification(donor['id'], request_message(request, donor['distance']), request['id'])
+                for donor in result['donors']
+            ]
+            notifications.extend(result['notifications'])
+        self.notify(notifications)
+        return results
+
+    def assign(self, requests, donors_per_unit=DONORS_PER_UNIT):
+        """Spread donors over a batch of open requests, most urgent first, and notify them
+
+        Donors already notified about a request (by submit, the scheduler or an
+        earlier assign) count towards it and are not asked again. Returns
+        {request id: [donor, ...]} of the donors newly notified, nearest first,
+        each with its distance in km.
+        """
+        already = {request['id']: self.database.notified_donors(request['id']) for request in requests}
+        with self._lock:
+            notified = {
+                request_id: {row for row in map(self.store.row_of, donor_ids) if row is not None}
+                for request_id, donor_ids in already.items()
+            }
+            assignments = assign_donors(
+                requests, self.buckets, self.store.column('latitude'), self.store.column('longitude'),
+                MAX_SEARCH_RADIUS, donors_per_unit, notified=notified
+            )
+            assigned = {
+                request_id: self._records([row for row, _ in pairs], [distance for _, distance in pairs])
+                for request_id, pairs in assignments.items()
+            }
+        self.notify([
+            new_notification(donor['id'], request_message(request, donor['distance']), request['id'])
+            for request in requests
+            for donor in assigned[request['id']]
+        ])
+        return assigned
+
+    def notify(self, notifications):
+        """Persist notifications in one database write and queue their delivery
+
+        SMS and push delivery happen on the dispatcher's worker threads, so this
+        returns immediately.
+        """
+        with self.recorder.timer('send_notifications', volume=len(notifications)):
+            self.database.insert_notifications(notifications)
+            with self._lock:
+                rows = [self.store.row_of(notification['donor_id']) for notification in notifications]
+                phones = [None if row is None else self.store.phones[row] for row in rows]
+            for notification, phone in zip(notifications, phones):
+                self.dispatcher.submit(notification, phone=phone)
+        return notifications
+
+    def _records(self, rows, distances):
+        donors = []
+        for row, distance in zip(rows, distances):
+            donor = self.store.record(row)
+            donor['distance'] = float(distance)
+            donors.append(donor)
+        return donors
+
+    def _load_rows(self, rows):
+        store = self.store
+        # Deferred donors wait in the eligibility heap; the rest who are available can match
+        until = next_eligible(store.column('last_donation')[rows])
+        deferred = until > time.time()
+        for row, when in zip(rows[deferred].tolist(), until[deferred].tolist()):
+            self.eligibility.defer(row, when)
+        matchable = (store.column('status_code')[rows] == AVAILABLE) & ~deferred
+        self.buckets.add_many(
+            rows[matchable], store.column('blood_code')[rows][matchable],
+            store.column('latitude')[rows][matchable], store.column('longitude')[rows][matchable]
+        )
+
+    def _refresh(self, row):
+        """Keep a donor in the buckets only while available and not deferred"""
+        store = self.store
+        if store.column('status_code')[row] == AVAILABLE and row not in self.eligibility:
+            self.buckets.add(row, store.column('blood_code')[row],
+                             store.column('latitude')[row], store.column('longitude')[row])
+        else:
+            self.buckets.remove(row)
+
+    def _defer(self, row):
+        """Re-check a changed donor's deferral and availability"""
+        until = int(next_eligible(self.store.column('last_donation')[row]))
+        if until > time.time():
+            self.eligibility.defer(row, until)
+        else:
+            self.eligibility.discard(row)
+        self._refresh(row)
@@ -0,0 +1,160 @@
+"""Local JSON-over-HTTP endpoint for the matching engine
+
+    python -m utils.engine_server --port 8765
+
+    GET  /health    donors known, matchable and deferred
+    POST /match     {"requests": [...]}  nearest donors per request, nothing stored
+    POST /requests  {"requests": [...]}  store new requests and notify their donors
+
+Each connection is handled on its own thread (ThreadingHTTPServer), so slow
+clients do not hold up others; matching itself is serialised by the engine.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Set to serve the engine from the Streamlit app's process as well
+PORT_ENV = 'BLOODCONNECT_ENGINE_PORT'
+# Largest request body accepted
+MAX_BODY_BYTES = 1 << 20
+# Seconds a handler may reuse the engine's last database sync
+SYNC_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serialisable")
+
+
+class EngineHandler(BaseHTTPRequestHandler):
+    """Routes JSON requests to the server's engine"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; with Nagle on, the body waits for
+    # the client's delayed ACK (about 40 ms) on every kept-alive call
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.server.engine.sync(SYNC_SECONDS)
+            self._reply(200, self.server.engine.stats())
+        else:
+            self._reply(404, {'error': f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        calls = {'/match': self.server.engine.match, '/requests': self.server.engine.submit}
+        call = calls.get(self.path)
+        if call is None:
+            self._reply(404, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            # The body cannot be found, so the connection cannot be reused
+            self.close_connection = True
+            self._reply(400, {'error': "Content-Length must be a number"})
+            return
+        if length < 0:
+            self.close_connection = True
+            self._reply(400, {'error': "Content-Length must not be negative"})
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._reply(413, {'error': f"Body over {MAX_BODY_BYTES} bytes"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError("Body must be a JSON object")
+            self.server.engine.sync(SYNC_SECONDS)
+            results = call(body.get('requests'))
+        except ValueError as error:
+            # json.JSONDecodeError is a ValueError too
+            self._reply(400, {'error': str(error)})
+        except Exception:
+            # e.g. a locked database; the client still gets a JSON answer
+            logger.exception("%s failed", self.path)
+            self._reply(500, {'error': "Internal error"})
+        else:
+            self._reply(200, {'results': results})
+        if self.server.metrics_path:
+            self.server.engine.recorder.maybe_write(self.server.metrics_path)
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload, default=_json_default).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Quiet by default; access logs would dominate the cost of a match
+        pass
+
+
+class EngineServer(ThreadingHTTPServer):
+    """One thread per connection, with room for bursts of new connections"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, engine, metrics_path=None):
+        super().__init__(address, EngineHandler)
+        self.engine = engine
+        # Where the engine's timings are written, if this process owns the file
+        self.metrics_path = metrics_path
+
+
+def serve(engine, host=HOST, port=DEFAULT_PORT, background=True, metrics_path=None):
+    """An HTTP server for engine on host:port, started on a daemon thread unless background is False
+
+    Port 0 picks a free port; the bound address is server.server_address.
+    With metrics_path, the engine's timings are written there in Prometheus
+    text format as requests come in.
+    """
+    server = EngineServer((host, port), engine, metrics_path)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    from utils.database import DEFAULT_PATH, Database
+    from utils.engine import MatchingEngine
+    from utils.instrumentation import METRICS_PATH
+    from utils.notification_system import FakeGateway, NotificationDispatcher
+    from utils.shared_store import SharedStore
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=int(os.environ.get(PORT_ENV) or DEFAULT_PORT))
+    parser.add_argument('--db', default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    engine = MatchingEngine(SharedStore(Database(args.db)), NotificationDispatcher(FakeGateway()))
+    engine.sync()
+    server = serve(engine, args.host, args.port, background=False, metrics_path=METRICS_PATH)
+    print(f"Matching engine on http://{args.host}:{server.server_address[1]} "
+          f"({engine.stats()['donors']} donors)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
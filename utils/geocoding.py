@@ -0,0 +1,139 @@
+"""Offline geocoding of location text against a bundled gazetteer"""
+import bisect
+import csv
+import functools
+import os
+import re
+from collections import Counter, defaultdict
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'data', 'gazetteer.csv')
+# Distinct lookups remembered per process
+CACHE_SIZE = 4096
+# Share of trigrams a misspelt name must have in common with a gazetteer name
+MIN_SIMILARITY = 0.5
+# Among equally good matches, the most specific kind of place wins
+KIND_ORDER = {'hospital': 0, 'locality': 1, 'city': 2}
+# Words too common in addresses to tell places apart; "Sunrise Hospital" must
+# not match "Sunshine Hospitals" on the trigrams of "hospital" alone
+GENERIC_WORDS = {'hospital', 'hospitals', 'road', 'rd', 'main'}
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def normalise(text):
+    """Lower case words separated by single spaces, punctuation dropped"""
+    return _NON_WORD.sub(' ', text.lower().replace("'", '')).strip()
+
+
+def _key(text):
+    """Normalised text without generic address words; empty if nothing else is left"""
+    return ' '.join(word for word in normalise(text).split(' ') if word not in GENERIC_WORDS)
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """Places by name and alias, indexed for exact, prefix and fuzzy lookup
+
+    Every name and alias is stored normalised, without generic words such as
+    "hospital" or "road", in a dict for exact hits and as a sorted list of
+    keys, one per word start, so a prefix such as "jubilee h" or "hills" is a
+    bisection: a flattened trie. Misspellings fall back to a trigram index
+    scored by overlap. Prefixes of a whole name beat prefixes of a later word,
+    and among equal matches hospitals beat localities, which beat cities.
+    geocode() is wrapped in an LRU cache keyed by the raw text.
+    """
+
+    def __init__(self, places, cache_size=CACHE_SIZE):
+        self.places = places
+        self._exact = {}
+        self._prefix_keys = []
+        self._prefix_places = []
+        self._prefix_ranks = []
+        self._trigram_places = defaultdict(set)
+        self._trigram_counts = {}
+        for index, place in enumerate(places):
+            for name in [place['name']] + place['aliases']:
+                key = _key(name) or normalise(name)
+                self._exact.setdefault(key, index)
+                words = key.split(' ')
+                for start in range(len(words)):
+                    self._prefix_keys.append(' '.join(words[start:]))
+                    self._prefix_places.append(index)
+                    self._prefix_ranks.append((start > 0, len(key)) + self._rank(index))
+                grams = _trigrams(key)
+                self._trigram_counts[(index, key)] = len(grams)
+                for gram in grams:
+                    self._trigram_places[gram].add((index, key))
+        order = sorted(range(len(self._prefix_keys)), key=self._prefix_keys.__getitem__)
+        self._prefix_keys = [self._prefix_keys[i] for i in order]
+        self._prefix_places = [self._prefix_places[i] for i in order]
+        self._prefix_ranks = [self._prefix_ranks[i] for i in order]
+        self.geocode = functools.lru_cache(maxsize=cache_size)(self._geocode)
+
+    def __len__(self):
+        return len(self.places)
+
+    def _geocode(self, text):
+        """The place a location string refers to, or None"""
+        parts = [part for part in map(_key, text.split(',')) if part] if text else []
+        return self._lookup(parts) if parts else None
+
+    def _lookup(self, parts):
+        # The whole text, then each comma-separated part in order ("Area, City"
+        # tries the area first). An exact or prefix hit on any part beats a
+        # fuzzy one, so "St Johns Hospital, Kondapur" lands in Kondapur rather
+        # than at the closest-spelt hospital
+        keys = [' '.join(parts)] + parts if len(parts) > 1 else parts
+        for match in (self._exact.get, self._prefix, self._fuzzy):
+            for key in keys:
+                index = match(key)
+                if index is not None:
+                    return self.places[index]
+        return None
+
+    def _prefix(self, key):
+        start = bisect.bisect_left(self._prefix_keys, key)
+        stop = bisect.bisect_left(self._prefix_keys, key + '\uffff', start)
+        if start == stop:
+            return None
+        best = min(range(start, stop), key=self._prefix_ranks.__getitem__)
+        return self._prefix_places[best]
+
+    def _fuzzy(self, key):
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigram_places.get(gram, ()))
+        best, best_score = None, MIN_SIMILARITY
+        for (index, name), count in shared.items():
+            # Dice coefficient of the two trigram sets
+            score = 2 * count / (len(grams) + self._trigram_counts[(index, name)])
+            if score > best_score or (score == best_score and best is not None
+                                      and self._rank(index) < self._rank(best)):
+                best, best_score = index, score
+        return best
+
+    def _rank(self, index):
+        return KIND_ORDER.get(self.places[index]['kind'], len(KIND_ORDER)), index
+
+
+def load_gazetteer(path=GAZETTEER_PATH, cache_size=CACHE_SIZE):
+    """Read a gazetteer CSV (name, kind, city, latitude, longitude, aliases separated by ';')"""
+    with open(path, newline='', encoding='utf-8') as f:
+        places = [
+            {
+                'name': row['name'],
+                'kind': row['kind'],
+                'city': row['city'],
+                'latitude': float(row['latitude']),
+                'longitude': float(row['longitude']),
+                'aliases': [alias for alias in row['aliases'].split(';') if alias],
+            }
+            for row in csv.DictReader(f)
+        ]
+    return Gazetteer(places, cache_size)
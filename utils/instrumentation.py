@@ -0,0 +1,182 @@
+"""Timing of hot paths, with percentiles and a Prometheus text export"""
+import functools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+# Set BLOODCONNECT_PROFILE=1 to start with instrumentation on
+ENABLED = os.environ.get('BLOODCONNECT_PROFILE', '') not in ('', '0')
+METRICS_PATH = os.environ.get('BLOODCONNECT_METRICS_FILE', 'bloodconnect_metrics.prom')
+# Recent samples kept per operation for percentiles
+SAMPLE_WINDOW = 1000
+QUANTILES = [0.5, 0.95, 0.99]
+# Minimum seconds between Prometheus file writes
+WRITE_INTERVAL = 10.0
+# p95 time for one full script rerun, in milliseconds; pages with charts get more
+RERUN_BUDGET_MS = 100
+CHART_RERUN_BUDGET_MS = {'Dashboard': 200, 'Find Donors': 400, 'Analytics': 300}
+
+
+def rerun_budget_ms(page):
+    return CHART_RERUN_BUDGET_MS.get(page, RERUN_BUDGET_MS)
+
+
+def _label(name):
+    return name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class _NullTiming:
+    """Stand-in timing used while instrumentation is off; ignores everything"""
+
+    volume = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+    def stop(self):
+        pass
+
+
+_NULL_TIMING = _NullTiming()
+
+
+class _Timing:
+    """Context manager that records its block's duration; set volume inside it"""
+
+    def __init__(self, recorder, name, volume):
+        self._recorder = recorder
+        self._name = name
+        self.volume = volume
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def stop(self):
+        self._recorder.record(self._name, time.perf_counter() - self._start, self.volume)
+
+
+class Recorder:
+    """Per-operation durations and data volumes, shared across sessions
+
+    timer() and timed() cost one attribute check while disabled, so the hooks
+    can stay in place in production.
+    """
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+        self._volumes = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+        self._count = defaultdict(int)
+        self._sum = defaultdict(float)
+        self._written = 0.0
+
+    def timer(self, name, volume=None):
+        """Context manager timing a block under name"""
+        if not self.enabled:
+            return _NULL_TIMING
+        return _Timing(self, name, volume)
+
+    def start(self, name, volume=None):
+        """Start timing a span that does not fit a with block; call stop() on the result"""
+        return self.timer(name, volume).__enter__()
+
+    def timed(self, name, volume=None):
+        """Decorator timing every call; volume(result) gives the data size, if wanted"""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                result = func(*args, **kwargs)
+                self.record(name, time.perf_counter() - start, None if volume is None else volume(result))
+                return result
+            return wrapper
+        return decorate
+
+    def record(self, name, seconds, volume=None):
+        with self._lock:
+            self._samples[name].append(seconds)
+            self._count[name] += 1
+            self._sum[name] += seconds
+            if volume is not None:
+                self._volumes[name].append(volume)
+
+    def reset(self):
+        with self._lock:
+            for table in (self._samples, self._volumes, self._count, self._sum):
+                table.clear()
+
+    def summary(self):
+        """One dict per operation: calls, percentiles (ms) and mean data volume"""
+        with self._lock:
+            names = sorted(self._samples)
+            samples = {name: np.array(self._samples[name]) for name in names}
+            volumes = {name: list(self._volumes[name]) for name in names}
+            counts = dict(self._count)
+        rows = []
+        for name in names:
+            ms = samples[name] * 1000
+            row = {'operation': name, 'calls': counts[name]}
+            for q in QUANTILES:
+                row[f'p{q * 100:g}_ms'] = float(np.quantile(ms, q))
+            row['max_ms'] = float(ms.max())
+            row['mean_volume'] = float(np.mean(volumes[name])) if volumes[name] else None
+            rows.append(row)
+        return rows
+
+    def prometheus_text(self):
+        """Durations as a Prometheus summary and recent volumes as a gauge"""
+        with self._lock:
+            names = sorted(self._samples)
+            samples = {name: np.array(self._samples[name]) for name in names}
+            volumes = {name: list(self._volumes[name]) for name in names}
+            counts, sums = dict(self._count), dict(self._sum)
+        lines = [
+            "# HELP bloodconnect_operation_seconds Time spent in instrumented operations",
+            "# TYPE bloodconnect_operation_seconds summary",
+        ]
+        for name in names:
+            label = _label(name)
+            for q in QUANTILES:
+                lines.append(f'bloodconnect_operation_seconds{{operation="{label}",quantile="{q:g}"}} '
+                             f'{np.quantile(samples[name], q):.6f}')
+            lines.append(f'bloodconnect_operation_seconds_sum{{operation="{label}"}} {sums[name]:.6f}')
+            lines.append(f'bloodconnect_operation_seconds_count{{operation="{label}"}} {counts[name]}')
+        lines += [
+            "# HELP bloodconnect_operation_volume Mean records handled per recent call",
+            "# TYPE bloodconnect_operation_volume gauge",
+        ]
+        for name in names:
+            if volumes[name]:
+                lines.append(f'bloodconnect_operation_volume{{operation="{_label(name)}"}} '
+                             f'{np.mean(volumes[name]):g}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path=METRICS_PATH):
+        """Replace the text file atomically, for node_exporter's textfile collector"""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+        self._written = time.time()
+
+    def maybe_write(self, path=METRICS_PATH):
+        """Write the text file if enabled and WRITE_INTERVAL has passed"""
+        if self.enabled and time.time() - self._written >= WRITE_INTERVAL:
+            self.write_prometheus(path)
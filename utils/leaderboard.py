@@ -0,0 +1,132 @@
+"""Donor rankings by points, kept in order as points change"""
+from collections import defaultdict
+
+from utils.chunked import ChunkedDict, ChunkedSortedList
+
+# Batches of at least this many rows are merged with one sort of the whole
+# board; smaller ones, such as a single registration, are inserted one by one
+SORT_BATCH = 1000
+
+
+def area_of(location):
+    """Area name of a 'Area, City' location string"""
+    return location.split(',')[0].strip()
+
+
+class Leaderboard:
+    """Donor rows ordered by points, highest first
+
+    Entries are (-points, row) keys in a chunked sorted list. An update removes
+    the old key and inserts the new one by bisection, so reading the top K is a
+    slice and a donor's rank is a binary search. A copy shares every chunk until
+    it changes one.
+    """
+
+    def __init__(self):
+        self._keys = ChunkedSortedList()
+        self._points = ChunkedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, row):
+        return row in self._points
+
+    def copy(self):
+        board = Leaderboard()
+        board._keys = self._keys.copy()
+        board._points = self._points.copy()
+        return board
+
+    def update(self, row, points):
+        """Add a row or move it to its new points total"""
+        self.remove(row)
+        self._keys.add((-points, row))
+        self._points[row] = points
+
+    def update_many(self, rows, points):
+        """Add a batch of rows not yet on the board, sorting the board once for large batches"""
+        if len(rows) >= SORT_BATCH:
+            self._keys.update(zip((-p for p in points), rows))
+        else:
+            for row, p in zip(rows, points):
+                self._keys.add((-p, row))
+        self._points.update(zip(rows, points))
+
+    def remove(self, row):
+        points = self._points.pop(row, None)
+        if points is not None:
+            self._keys.remove((-points, row))
+
+    def top(self, k):
+        """(row, points) for the k highest-scoring donors"""
+        return [(row, -negative) for negative, row in self._keys.head(k)]
+
+    def rank(self, row):
+        """1-based rank of a row (donors with equal points share a rank), or None"""
+        points = self._points.get(row)
+        if points is None:
+            return None
+        return self._keys.index((-points,)) + 1
+
+
+class Leaderboards:
+    """Overall, per-area and per-blood-type leaderboards updated together"""
+
+    def __init__(self):
+        self.overall = Leaderboard()
+        self.by_area = defaultdict(Leaderboard)
+        self.by_blood_type = defaultdict(Leaderboard)
+        # Boards this object may change; None for all of them
+        self._owned = None
+
+    def copy(self):
+        """Leaderboards that can change without changing these
+
+        Each board is copied only when the copy first changes it.
+        """
+        boards = Leaderboards()
+        boards.overall = self.overall
+        boards.by_area = defaultdict(Leaderboard, self.by_area)
+        boards.by_blood_type = defaultdict(Leaderboard, self.by_blood_type)
+        boards._owned = set()
+        return boards
+
+    def _board(self, boards, key):
+        """A board from by_area or by_blood_type (None for overall), safe to change in place"""
+        board = self.overall if boards is None else boards[key]
+        if self._owned is not None and id(board) not in self._owned:
+            board = board.copy()
+            if boards is None:
+                self.overall = board
+            else:
+                boards[key] = board
+            self._owned.add(id(board))
+        return board
+
+    def update(self, row, points, location, blood_type):
+        self._board(None, None).update(row, points)
+        self._board(self.by_area, area_of(location)).update(row, points)
+        self._board(self.by_blood_type, blood_type).update(row, points)
+
+    def remove(self, row, location, blood_type):
+        """Take a donor off the boards for their current area and blood type"""
+        self._board(None, None).remove(row)
+        self._board(self.by_area, area_of(location)).remove(row)
+        self._board(self.by_blood_type, blood_type).remove(row)
+
+    def update_many(self, rows, points, locations, blood_types):
+        """Add a batch of new rows, grouping them per area and blood type first"""
+        self._board(None, None).update_many(rows, points)
+        by_area, by_blood_type = defaultdict(list), defaultdict(list)
+        for row, p, location, blood_type in zip(rows, points, locations, blood_types):
+            by_area[area_of(location)].append((row, p))
+            by_blood_type[blood_type].append((row, p))
+        for boards, groups in ((self.by_area, by_area), (self.by_blood_type, by_blood_type)):
+            for key, entries in groups.items():
+                self._board(boards, key).update_many([row for row, _ in entries], [p for _, p in entries])
+
+    def is_local_champion(self, row, location):
+        """Whether a donor tops the leaderboard for their area"""
+        board = self.by_area.get(area_of(location))
+        return bool(board) and board.top(1)[0][0] == row
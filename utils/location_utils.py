@@ -0,0 +1,244 @@
+"""Location helpers: distance calculation and spatial indexing of donor coordinates"""
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from utils.chunked import ChunkedDict
+
+EARTH_RADIUS_KM = 6371.0088
+# Haversine on the mean-radius sphere stays within 0.6% of the WGS-84 geodesic
+HAVERSINE_REL_ERROR = 0.006
+# Shortest length of one degree of latitude (at the equator), in km.
+# Using the minimum keeps bounding boxes conservative.
+KM_PER_DEGREE = 110.574
+# WGS-84 ellipsoid: semi-major axis (km) and flattening
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+VINCENTY_TOLERANCE = 1e-12
+VINCENTY_MAX_ITERATIONS = 200
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distances (km) from one point to arrays of points"""
+    lat1 = math.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def geodesic_km(lat, lon, lats, lons):
+    """Exact WGS-84 distances (km) from one point to arrays of points
+
+    Vincenty's inverse formula iterated on the whole batch at once; the few
+    points where it fails to converge (nearly antipodal) fall back to geopy.
+    Agrees with geopy to well under a millimetre.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    a, f = WGS84_A_KM, WGS84_F
+    b = a * (1 - f)
+    u1 = math.atan((1 - f) * math.tan(math.radians(lat)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lats)))
+    sin_u1, cos_u1 = math.sin(u1), math.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    big_l = np.radians(lons - lon)
+    lam = big_l.copy()
+    converged = np.zeros(len(lats), dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sm = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = big_l + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sm + c * cos_sigma * (2 * cos_2sm ** 2 - 1)))
+            converged = np.abs(lam - previous) <= VINCENTY_TOLERANCE
+            if converged.all():
+                break
+        u_sq = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sm + big_b / 4 * (
+            cos_sigma * (2 * cos_2sm ** 2 - 1)
+            - big_b / 6 * cos_2sm * (4 * sin_sigma ** 2 - 3) * (4 * cos_2sm ** 2 - 3)))
+        dist = b * big_a * (sigma - delta_sigma)
+    fallback = np.flatnonzero(~converged | ~np.isfinite(dist))
+    if len(fallback):
+        # Rare enough that geopy is only imported when needed
+        from geopy.distance import geodesic
+    for i in fallback:
+        dist[i] = geodesic((lat, lon), (lats[i], lons[i])).kilometers
+    return dist
+
+
+def distances_within(lat, lon, lats, lons, radius_km, limit=None):
+    """Positions of points within radius_km, nearest first, and their distances
+
+    Haversine is computed for the whole batch in one pass. Exact geodesic is only
+    computed where haversine could disagree with it: points close to the radius
+    and neighbours whose distances are too close to order. Membership and order
+    are therefore the same as a geodesic scan of every point.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    dist = haversine_km(lat, lon, lats, lons)
+    exact = np.zeros(len(dist), dtype=bool)
+
+    def refine(positions):
+        dist[positions] = geodesic_km(lat, lon, lats[positions], lons[positions])
+        exact[positions] = True
+
+    # Points in the error band around the radius
+    refine(np.flatnonzero(np.abs(dist - radius_km) <= dist * HAVERSINE_REL_ERROR))
+    inside = np.flatnonzero(dist <= radius_km)
+    if limit is not None and len(inside) > limit:
+        # Only the nearest limit (plus anything that could tie with them) are sorted
+        kth = np.partition(dist[inside], limit - 1)[limit - 1]
+        inside = inside[dist[inside] <= kth * (1 + 2 * HAVERSINE_REL_ERROR)]
+    order = inside[np.argsort(dist[inside], kind='stable')]
+
+    # Neighbours whose error bands overlap
+    ranked = dist[order]
+    slack = ranked * HAVERSINE_REL_ERROR
+    close = np.diff(ranked) <= slack[1:] + slack[:-1]
+    ambiguous = np.zeros(len(order), dtype=bool)
+    ambiguous[:-1] |= close
+    ambiguous[1:] |= close
+    ambiguous &= ~exact[order]
+    if ambiguous.any():
+        refine(order[ambiguous])
+        order = order[np.argsort(dist[order], kind='stable')]
+
+    if limit is not None:
+        order = order[:limit]
+    return order, dist[order]
+
+
+class GridIndex:
+    """Uniform lat/lon grid mapping each cell to the donor rows inside it"""
+
+    def __init__(self, cell_km=5.0):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self._cells = ChunkedDict()
+        self._row_cell = ChunkedDict()
+        # Cells whose sets this index may change; None for all of them
+        self._owned = None
+
+    def __len__(self):
+        return len(self._row_cell)
+
+    def __contains__(self, row):
+        return row in self._row_cell
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def copy(self):
+        """An index that can change without changing this one
+
+        Cell sets, and the chunks of both maps, are shared until the copy first
+        changes them.
+        """
+        index = GridIndex.__new__(GridIndex)
+        index.cell_deg = self.cell_deg
+        index._cells = self._cells.copy()
+        index._row_cell = self._row_cell.copy()
+        index._owned = set()
+        return index
+
+    def _members(self, cell):
+        """The set of rows in a cell, safe to change in place"""
+        members = self._cells.get(cell)
+        if members is None:
+            members = self._cells[cell] = set()
+        elif self._owned is not None and cell not in self._owned:
+            members = self._cells[cell] = set(members)
+        if self._owned is not None:
+            self._owned.add(cell)
+        return members
+
+    def add(self, row, lat, lon):
+        """Index a donor row at the given coordinates (moves it if already indexed)"""
+        cell = self._cell(lat, lon)
+        old = self._row_cell.get(row)
+        if old == cell:
+            return
+        if old is not None:
+            self._discard(row, old)
+        self._members(cell).add(row)
+        self._row_cell[row] = cell
+
+    def add_many(self, rows, lats, lons):
+        """Index a batch of rows that are not indexed yet, computing cells in one pass"""
+        ys = np.floor(np.asarray(lats) / self.cell_deg).astype(np.int64).tolist()
+        xs = np.floor(np.asarray(lons) / self.cell_deg).astype(np.int64).tolist()
+        rows = np.asarray(rows).tolist()
+        cells = list(zip(ys, xs))
+        by_cell = defaultdict(list)
+        for row, cell in zip(rows, cells):
+            by_cell[cell].append(row)
+        for cell, members in by_cell.items():
+            self._members(cell).update(members)
+        self._row_cell.update(zip(rows, cells))
+
+    def remove(self, row):
+        """Drop a donor row from the index; unknown rows are ignored"""
+        cell = self._row_cell.pop(row, None)
+        if cell is not None:
+            self._discard(row, cell)
+
+    def _discard(self, row, cell):
+        members = self._members(cell)
+        members.discard(row)
+        if not members:
+            del self._cells[cell]
+
+    def cells_within(self, lat, lon, radius_km):
+        """Grid cells overlapping the bounding box of a radius around a point"""
+        dlat = radius_km / KM_PER_DEGREE
+        max_lat = min(abs(lat) + dlat, 89.9)
+        dlon = min(radius_km / (KM_PER_DEGREE * math.cos(math.radians(max_lat))), 180.0)
+        y0, x0 = self._cell(lat - dlat, lon - dlon)
+        y1, x1 = self._cell(lat + dlat, lon + dlon)
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                yield (y, x)
+
+    def rows_in(self, cells):
+        """Rows indexed in any of the given cells"""
+        occupied = self._cells
+        rows = []
+        for cell in cells:
+            members = occupied.get(cell)
+            if members:
+                rows.extend(members)
+        return rows
+
+    def query(self, lat, lon, radius_km):
+        """Candidate rows that may lie within radius_km; callers check exact distance"""
+        return self.rows_in(self.cells_within(lat, lon, radius_km))
+
+
+def aggregate_points(lats, lons, codes, cell_deg, n_codes):
+    """Group points into cells of cell_deg degrees
+
+    Returns per occupied cell the mean latitude and longitude, the point count
+    and a (cells, n_codes) array of counts per code (e.g. blood type).
+    """
+    keys = np.stack([np.floor(np.asarray(lats) / cell_deg), np.floor(np.asarray(lons) / cell_deg)], axis=1)
+    _, cell_of, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    cell_of = cell_of.ravel()
+    mean_lat = np.bincount(cell_of, weights=lats) / counts
+    mean_lon = np.bincount(cell_of, weights=lons) / counts
+    per_code = np.bincount(cell_of * n_codes + np.asarray(codes, dtype=np.int64),
+                           minlength=len(counts) * n_codes).reshape(len(counts), n_codes)
+    return mean_lat, mean_lon, counts, per_code
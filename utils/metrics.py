@@ -0,0 +1,68 @@
+"""Platform counters maintained incrementally for the dashboard"""
+import copy
+from collections import Counter
+
+URGENCY_LEVELS = ['Critical', 'High', 'Medium', 'Low']
+
+
+class PlatformMetrics:
+    """Totals and breakdowns updated in O(1) as donors and requests change
+
+    Reading a figure never looks at the underlying donors or requests, so the
+    dashboard costs the same whatever the data size.
+    """
+
+    def __init__(self):
+        self.total_donors = 0
+        self.donors_by_status = Counter()
+        self.donors_by_blood_type = Counter()
+        self.total_requests = 0
+        self.requests_by_status = Counter()
+        self.active_requests_by_urgency = Counter()
+        self.total_donations = 0
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def donors_added(self, blood_types, statuses):
+        """Count a batch of donors given their blood types and statuses"""
+        self.total_donors += len(blood_types)
+        self.donors_by_status.update(statuses)
+        self.donors_by_blood_type.update(blood_types)
+
+    def donor_status_changed(self, old_status, new_status):
+        if old_status != new_status:
+            self.donors_by_status[old_status] -= 1
+            self.donors_by_status[new_status] += 1
+
+    def donor_blood_type_changed(self, old_blood_type, new_blood_type):
+        if old_blood_type != new_blood_type:
+            self.donors_by_blood_type[old_blood_type] -= 1
+            self.donors_by_blood_type[new_blood_type] += 1
+
+    def request_added(self, urgency, status):
+        self.total_requests += 1
+        self.requests_by_status[status] += 1
+        if status == 'Active':
+            self.active_requests_by_urgency[urgency] += 1
+
+    def request_status_changed(self, urgency, old_status, new_status):
+        if old_status == new_status:
+            return
+        self.requests_by_status[old_status] -= 1
+        self.requests_by_status[new_status] += 1
+        if old_status == 'Active':
+            self.active_requests_by_urgency[urgency] -= 1
+        elif new_status == 'Active':
+            self.active_requests_by_urgency[urgency] += 1
+
+    def donation_added(self):
+        self.total_donations += 1
+
+    @property
+    def active_donors(self):
+        return self.donors_by_status['Available']
+
+    @property
+    def pending_requests(self):
+        return self.requests_by_status['Active']
@@ -0,0 +1,279 @@
+"""Notification delivery (queued, batched per channel, retried) and per-donor inboxes"""
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+
+from utils.chunked import ChunkedDict
+
+CHANNELS = ['sms', 'push']
+# Seconds a 'sent' or 'failed' delivery state is kept before it is forgotten
+DELIVERY_RETENTION = 24 * 60 * 60
+
+
+def new_notification(donor_id, message, request_id=None, timestamp=None):
+    """An unread notification for a donor, stamped now unless timestamp is given"""
+    return {
+        'id': str(uuid.uuid4()),
+        'donor_id': donor_id,
+        'message': message,
+        'timestamp': timestamp or datetime.now(),
+        'request_id': request_id,
+        'status': 'unread',
+    }
+
+
+def request_message(request, distance):
+    """Notification text asking a donor to help with a request"""
+    return (f"🚨 URGENT: {request['patient_name']} needs {request['blood_type']} blood "
+            f"at {request['hospital_name']}. Distance: {distance:.1f}km")
+
+
+class FakeGateway:
+    """In-process transport that records batches instead of calling a network API
+
+    latency is slept once per batch; failure_rate is the chance that each message
+    in a batch is rejected, to exercise the retry path.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.batches = Counter()
+        self.delivered = defaultdict(list)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send_batch(self, channel, messages):
+        """Deliver a batch and return the ids of the messages that failed"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = {m['id'] for m in messages if self._random.random() < self.failure_rate}
+            self.batches[channel] += 1
+            self.delivered[channel].extend(m for m in messages if m['id'] not in failed)
+        return failed
+
+
+class NotificationDispatcher:
+    """Queues notifications and delivers them from worker threads
+
+    Each channel has its own queue; a worker takes up to batch_size messages
+    (waiting at most max_wait for a batch to fill) and hands them to the
+    transport in one call. Failed messages are retried with exponential backoff
+    up to max_attempts. Delivery state is kept per (notification id, channel):
+    'queued', 'sent' or 'failed'. Final states are dropped after retention
+    seconds, so memory follows recent traffic rather than all traffic.
+    """
+
+    def __init__(self, transport, workers=4, batch_size=50, max_wait=0.05,
+                 max_attempts=4, backoff=0.5, retention=DELIVERY_RETENTION):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.retention = retention
+        self._queues = {channel: queue.Queue() for channel in CHANNELS}
+        self._status = {}
+        # (time finished, key) for final states, oldest first
+        self._finished = deque()
+        self._retries = []
+        self._seq = itertools.count()
+        self._pending = 0
+        self._lock = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._work, args=(CHANNELS[i % len(CHANNELS)],), daemon=True)
+            for i in range(max(workers, len(CHANNELS)))
+        ]
+        self._threads.append(threading.Thread(target=self._requeue_due, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, notification, phone=None, channels=CHANNELS):
+        """Queue a notification for delivery on each channel; returns immediately"""
+        with self._lock:
+            for channel in channels:
+                self._status[(notification['id'], channel)] = 'queued'
+                self._pending += 1
+        for channel in channels:
+            self._queues[channel].put({
+                'id': notification['id'],
+                'channel': channel,
+                'to': phone if channel == 'sms' else notification['donor_id'],
+                'body': notification['message'],
+                'attempt': 1,
+            })
+
+    def delivery_status(self, notification_id):
+        """Channel -> delivery state for one notification (empty once it is past retention)"""
+        with self._lock:
+            return {channel: self._status[(notification_id, channel)]
+                    for channel in CHANNELS if (notification_id, channel) in self._status}
+
+    def stats(self):
+        """Number of deliveries in each state"""
+        with self._lock:
+            return Counter(self._status.values())
+
+    def flush(self, timeout=None):
+        """Wait until every queued delivery has been sent or has failed for good"""
+        with self._lock:
+            return self._lock.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self):
+        self._stopped.set()
+
+    def _next_batch(self, channel):
+        source = self._queues[channel]
+        try:
+            batch = [source.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(source.get(timeout=remaining) if remaining > 0 else source.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self, channel):
+        while not self._stopped.is_set():
+            batch = self._next_batch(channel)
+            if not batch:
+                continue
+            try:
+                failed = self.transport.send_batch(channel, batch)
+            except Exception:
+                failed = {message['id'] for message in batch}
+            with self._lock:
+                now = time.monotonic()
+                for message in batch:
+                    key = (message['id'], channel)
+                    if message['id'] not in failed:
+                        self._status[key] = 'sent'
+                    elif message['attempt'] >= self.max_attempts:
+                        self._status[key] = 'failed'
+                    else:
+                        delay = self.backoff * 2 ** (message['attempt'] - 1)
+                        message = dict(message, attempt=message['attempt'] + 1)
+                        heapq.heappush(self._retries, (now + delay, next(self._seq), message))
+                        continue
+                    self._finished.append((now, key))
+                    self._pending -= 1
+                self._forget(now - self.retention)
+                self._lock.notify_all()
+
+    def _forget(self, before):
+        """Drop final states reached before a monotonic time; call with the lock held"""
+        while self._finished and self._finished[0][0] < before:
+            _, key = self._finished.popleft()
+            if self._status.get(key) in ('sent', 'failed'):
+                del self._status[key]
+
+    def _requeue_due(self):
+        while not self._stopped.is_set():
+            due = []
+            with self._lock:
+                now = time.monotonic()
+                while self._retries and self._retries[0][0] <= now:
+                    due.append(heapq.heappop(self._retries)[2])
+            for message in due:
+                self._queues[message['channel']].put(message)
+            time.sleep(0.05)
+
+
+class NotificationInbox:
+    """Notifications indexed by id and by donor, each donor's list in arrival order
+
+    Lists are append-only, so a position is a stable pagination cursor. Unread
+    totals per donor are kept as counters.
+    """
+
+    def __init__(self):
+        self._by_id = ChunkedDict()
+        self._by_donor = ChunkedDict()
+        self._unread = ChunkedDict()
+        # Per-donor lists this inbox may change; None for all of them
+        self._owned = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def copy(self):
+        """An inbox that can change without changing this one
+
+        Notifications are never changed in place, and each donor's list, like
+        each chunk of the indexes, is copied only when the copy first changes it.
+        """
+        inbox = NotificationInbox()
+        inbox._by_id = self._by_id.copy()
+        inbox._by_donor = self._by_donor.copy()
+        inbox._unread = self._unread.copy()
+        inbox._owned = set()
+        return inbox
+
+    def _list(self, donor_id):
+        """A donor's list, safe to change in place"""
+        items = self._by_donor.get(donor_id)
+        if items is None or self._owned is not None and donor_id not in self._owned:
+            items = self._by_donor[donor_id] = list(items or [])
+            if self._owned is not None:
+                self._owned.add(donor_id)
+        return items
+
+    def add(self, notification):
+        self._by_id[notification['id']] = notification
+        self._list(notification['donor_id']).append(notification)
+        if notification['status'] == 'unread':
+            self._count_unread(notification['donor_id'], 1)
+
+    def _count_unread(self, donor_id, change):
+        self._unread[donor_id] = self._unread.get(donor_id, 0) + change
+
+    def get(self, notification_id):
+        return self._by_id.get(notification_id)
+
+    def mark(self, notification_id, status):
+        """Set a notification's status, keeping the unread counter in step"""
+        notification = self._by_id[notification_id]
+        if notification['status'] == status:
+            return notification
+        if notification['status'] == 'unread':
+            self._count_unread(notification['donor_id'], -1)
+        elif status == 'unread':
+            self._count_unread(notification['donor_id'], 1)
+        # Replaced rather than changed, as copies of the inbox may hold it
+        updated = self._by_id[notification_id] = dict(notification, status=status)
+        items = self._list(notification['donor_id'])
+        items[next(i for i in range(len(items) - 1, -1, -1) if items[i] is notification)] = updated
+        return updated
+
+    def unread_count(self, donor_id):
+        return self._unread.get(donor_id, 0)
+
+    def page(self, donor_id, cursor=None, limit=20, unread_only=True):
+        """A page of a donor's notifications, newest first, and the cursor for the next one
+
+        The returned cursor is None when there are no older notifications.
+        """
+        items = self._by_donor.get(donor_id, [])
+        position = len(items) if cursor is None else cursor
+        page = []
+        while position > 0 and len(page) < limit:
+            position -= 1
+            if not unread_only or items[position]['status'] == 'unread':
+                page.append(items[position])
+        if unread_only:
+            # Skip read items so an empty older page is never offered
+            while position > 0 and items[position - 1]['status'] != 'unread':
+                position -= 1
+        return page, (position or None)
@@ -0,0 +1,170 @@
+"""Background re-matching, escalation and expiry of active blood requests"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from utils.blood_matching import BLOOD_COMPATIBILITY
+from utils.eligibility import DEFERRAL_SECONDS
+from utils.location_utils import distances_within
+from utils.metrics import URGENCY_LEVELS
+from utils.notification_system import new_notification, request_message
+
+# Per urgency: seconds between checks, (radius km, donors notified in all) for
+# each successive check (the last step repeats), and seconds until the request expires
+ESCALATION = {
+    'Critical': {'every': 5 * 60, 'steps': [(15, 10), (30, 20), (60, 30), (100, 50)],
+                 'expires': 24 * 60 * 60},
+    'High': {'every': 15 * 60, 'steps': [(15, 10), (25, 15), (50, 20)],
+             'expires': 2 * 24 * 60 * 60},
+    'Medium': {'every': 60 * 60, 'steps': [(30, 10)], 'expires': 7 * 24 * 60 * 60},
+    'Low': {'every': 4 * 60 * 60, 'steps': [(15, 10)], 'expires': 14 * 24 * 60 * 60},
+}
+# Seconds between looks for new requests and due checks
+POLL_SECONDS = 5.0
+# Seconds before a check that raised (e.g. on a locked database) is tried again
+RETRY_SECONDS = 30.0
+
+logger = logging.getLogger(__name__)
+
+# Recipient type -> donor types that can give to it
+DONOR_TYPES = {
+    recipient: [donor for donor, recipients in BLOOD_COMPATIBILITY.items() if recipient in recipients]
+    for recipient in BLOOD_COMPATIBILITY
+}
+
+
+class EscalationScheduler:
+    """Revisits active requests from a worker thread, each only when it is due
+
+    Active requests sit in a heap ordered by next check time, then urgency.
+    A check re-reads the request, and if it is still Active and not stale it
+    tops up the donors notified about it to the step's count, from donors who
+    became available or came within range since the last check, widening the
+    radius and count step by step for Critical and High requests.
+    Requests older than their urgency's lifetime move to Expired. Everything
+    goes through the database, so Streamlit reruns only pick up the resulting
+    notifications and status changes instead of scanning requests themselves.
+    """
+
+    def __init__(self, database, dispatcher, poll=POLL_SECONDS, clock=time.time, start=True):
+        self.database = database
+        self.dispatcher = dispatcher
+        self.poll = poll
+        self.clock = clock
+        self._heap = []
+        self._steps = {}
+        self._seq = itertools.count()
+        self._synced = 0
+        self._changes = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        if start:
+            self._thread.start()
+
+    def __len__(self):
+        return len(self._steps)
+
+    def status_changes(self, after=0):
+        """(request id, new status) pairs made since position after, and the new position"""
+        with self._lock:
+            return self._changes[after:], len(self._changes)
+
+    def close(self):
+        self._stopped.set()
+
+    def tick(self):
+        """Pick up new requests and run every check that is due; returns checks run"""
+        self._load_new()
+        now = self.clock()
+        checked = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, rank, _, request_id = heapq.heappop(self._heap)
+            try:
+                self._check(request_id, now)
+            except Exception:
+                # A failed check must not stop escalation for everyone else, nor
+                # drop this request: it stays in _steps, so nothing else requeues it
+                logger.exception("Escalation check failed for request %s; retrying in %gs",
+                                 request_id, RETRY_SECONDS)
+                heapq.heappush(self._heap, (now + RETRY_SECONDS, rank, next(self._seq), request_id))
+            checked += 1
+        return checked
+
+    def _run(self):
+        while not self._stopped.wait(self.poll):
+            try:
+                self.tick()
+            except Exception:
+                # Loading new requests failed; the next poll tries again from the same rowid
+                logger.exception("Escalation scheduler tick failed")
+
+    def _load_new(self):
+        for rowid, request in self.database.load_requests(self._synced):
+            self._synced = rowid
+            if request['status'] == 'Active' and request['id'] not in self._steps:
+                # The page already notified the first step's donors
+                self._steps[request['id']] = 0
+                self._schedule(request, request['created_at'].timestamp())
+
+    def _schedule(self, request, after):
+        policy = ESCALATION[request['urgency']]
+        due = min(after + policy['every'], request['created_at'].timestamp() + policy['expires'])
+        heapq.heappush(self._heap, (due, URGENCY_LEVELS.index(request['urgency']),
+                                    next(self._seq), request['id']))
+
+    def _check(self, request_id, now):
+        request = self.database.load_request(request_id)
+        if request is None or request['status'] != 'Active':
+            self._steps.pop(request_id, None)
+            return
+        policy = ESCALATION[request['urgency']]
+        if now - request['created_at'].timestamp() >= policy['expires']:
+            self._steps.pop(request_id, None)
+            if self.database.transition_request(request, 'Expired', 'Active'):
+                with self._lock:
+                    self._changes.append((request_id, 'Expired'))
+            return
+        step = min(self._steps[request_id] + 1, len(policy['steps']) - 1)
+        radius, count = policy['steps'][step]
+        self._notify(request, radius, count, now)
+        # Only a check that went through moves the request to its next step
+        self._steps[request_id] = step
+        self._schedule(request, now)
+
+    def _notify(self, request, radius, count, now):
+        """Notify compatible donors within radius not yet asked, until count in all have been asked"""
+        already = self.database.notified_donors(request['id'])
+        wanted = count - len(already)
+        if wanted <= 0:
+            return []
+        lat, lon = request['latitude'], request['longitude']
+        candidates = [
+            donor for donor in self.database.find_candidates(
+                DONOR_TYPES[request['blood_type']], lat, lon, radius,
+                donated_before=datetime.fromtimestamp(now - DEFERRAL_SECONDS),
+                limit=count
+            )
+            if donor['id'] not in already
+        ]
+        if not candidates:
+            return []
+        positions, distances = distances_within(
+            lat, lon, np.array([donor['latitude'] for donor in candidates]),
+            np.array([donor['longitude'] for donor in candidates]), radius, limit=wanted
+        )
+        donors = [candidates[position] for position in positions[:wanted]]
+        notifications = [
+            new_notification(donor['id'], request_message(request, distance), request['id'],
+                             datetime.fromtimestamp(now))
+            for donor, distance in zip(donors, distances[:wanted].tolist())
+        ]
+        self.database.insert_notifications(notifications)
+        for donor, notification in zip(donors, notifications):
+            self.dispatcher.submit(notification, phone=donor['phone'])
+        return notifications
@@ -0,0 +1,309 @@
+"""One donor and request store per process, read through immutable snapshots
+
+Every Streamlit session reads the same Snapshot: donors, their indexes,
+requests, notifications and counters as of one version. A writer takes the
+store's lock, builds the next version from copies of only the parts it
+changes, and publishes it by swapping a single reference, so readers never
+wait for writers and never see a half-applied change.
+"""
+import threading
+from collections import namedtuple
+
+from utils.analytics import ActivityRollups
+from utils.chunked import ChunkedDict, ChunkedList
+from utils.donor_store import STATUSES, DonorStore, to_epoch
+from utils.leaderboard import Leaderboards
+from utils.location_utils import GridIndex
+from utils.metrics import PlatformMetrics
+from utils.notification_system import NotificationInbox
+
+# Donor rows loaded from the database per batch
+SYNC_BATCH_ROWS = 50_000
+# Changed donor rows kept for the matching engine; a caller further behind re-checks every row
+DONOR_CHANGES_KEPT = 50_000
+# Donor fields the matching engine indexes on
+MATCHING_FIELDS = ['status', 'last_donation', 'blood_type', 'latitude', 'longitude']
+# Parts of a snapshot a write may replace
+PARTS = ['donors', 'grid', 'leaderboards', 'metrics', 'rollups', 'inbox', 'requests']
+
+# donors: every donor, whatever their status; grid: spatial index over them for
+# Find Donors; the rest feed the dashboard, analytics, leaderboard and inbox
+Snapshot = namedtuple('Snapshot', ['version'] + PARTS)
+
+
+class RequestLog:
+    """Blood requests in arrival order, with lookup by id
+
+    Request dicts are replaced rather than changed, so copies share them.
+    """
+
+    def __init__(self):
+        self._items = ChunkedList()
+        self._positions = ChunkedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def copy(self):
+        log = RequestLog()
+        log._items = self._items.copy()
+        log._positions = self._positions.copy()
+        return log
+
+    def add(self, request):
+        self._positions[request['id']] = len(self._items)
+        self._items.append(request)
+
+    def get(self, request_id):
+        position = self._positions.get(request_id)
+        return None if position is None else self._items[position]
+
+    def replace(self, request):
+        """Swap in a changed request under the same id"""
+        self._items[self._positions[request['id']]] = request
+
+    def latest(self, k):
+        """The k most recent requests, oldest first"""
+        return [self._items[i] for i in range(max(len(self._items) - k, 0), len(self._items))]
+
+
+def empty_snapshot():
+    return Snapshot(0, DonorStore(), GridIndex(), Leaderboards(), PlatformMetrics(),
+                    ActivityRollups(), NotificationInbox(), RequestLog())
+
+
+class _Draft:
+    """The next snapshot, copying each part of the current one when first used"""
+
+    def __init__(self, snapshot):
+        self._base = snapshot
+        self._parts = {}
+        # Existing donor rows whose MATCHING_FIELDS this draft changes
+        self.changed_rows = []
+
+    def __getattr__(self, name):
+        if name not in PARTS:
+            raise AttributeError(name)
+        part = self._parts.get(name)
+        if part is None:
+            part = self._parts[name] = getattr(self._base, name).copy()
+        return part
+
+    def publish(self):
+        """The new snapshot, or the current one if nothing was touched"""
+        if not self._parts:
+            return self._base
+        return self._base._replace(version=self._base.version + 1, **self._parts)
+
+
+class SharedStore:
+    """Donors and requests shared by every session in a process
+
+    snapshot() is a plain attribute read and never blocks. Writes are
+    serialised by one lock; each persists to the database, applies to a draft
+    and publishes it. Snapshots must be treated as read-only.
+    """
+
+    def __init__(self, database, scheduler=None):
+        self.database = database
+        self.scheduler = scheduler
+        self._snapshot = empty_snapshot()
+        self._lock = threading.Lock()
+        # Last database rowid loaded, per table (for donors, the last revision)
+        self._synced = {'donors': 0, 'requests': 0, 'responses': 0, 'donations': 0, 'notifications': 0}
+        # Position in the escalation scheduler's log of status changes
+        self._scheduler_cursor = 0
+        # Donor rows changed by published writes, in order, for the matching engine:
+        # (snapshot, position of the first row kept, position after the last
+        # published row, the rows). Replaced as one value, so donor_changes()
+        # reads it without the lock; the list is only appended to past the end
+        self._donor_changes = (self._snapshot, 0, 0, [])
+
+    def snapshot(self):
+        return self._snapshot
+
+    def donor_changes(self, after=0):
+        """The latest snapshot, the donor rows changed since position after, and the new position
+
+        Rows added since are not listed; they follow the rows the caller has seen.
+        The rows are None when some after position after are no longer kept.
+        Never blocks, even while a sync is loading.
+        """
+        snapshot, first, end, rows = self._donor_changes
+        if after < first:
+            return snapshot, None, end
+        return snapshot, rows[after - first:end - first], end
+
+    def sync(self, wait=True):
+        """Load rows written since the last sync, by any session or process
+
+        With wait False, a sync already running on another thread is not
+        waited for. Returns the latest snapshot.
+        """
+        if not self._lock.acquire(blocking=wait):
+            return self._snapshot
+        try:
+            draft = _Draft(self._snapshot)
+            marks = dict(self._synced)
+            cursor = self._load(draft, marks)
+            self._publish(draft)
+            self._synced, self._scheduler_cursor = marks, cursor
+        finally:
+            self._lock.release()
+        return self._snapshot
+
+    def set_request_status(self, request_id, status):
+        """Move a request to a new status (e.g. Fulfilled) and persist it"""
+        with self._lock:
+            request = self._snapshot.requests.get(request_id)
+            if request is None or request['status'] == status:
+                return
+            self.database.insert_request(dict(request, status=status))
+            draft = _Draft(self._snapshot)
+            self._change_status(draft, request, status)
+            self._publish(draft)
+
+    def set_donor_status(self, donor_id, status):
+        """Change a donor's availability and persist it; the matching engine picks it up"""
+        with self._lock:
+            self.database.update_donor_status(donor_id, status)
+            row = self._snapshot.donors.row_of(donor_id)
+            if row is None:
+                return
+            draft = _Draft(self._snapshot)
+            draft.metrics.donor_status_changed(STATUSES[draft.donors.column('status_code')[row]], status)
+            draft.donors.set_status(row, status)
+            draft.changed_rows.append(row)
+            self._publish(draft)
+
+    def award_points(self, donor_id, points):
+        """Add points to a donor and persist the new total, keeping the leaderboards in step"""
+        with self._lock:
+            row = self._snapshot.donors.row_of(donor_id)
+            if row is None:
+                return
+            draft = _Draft(self._snapshot)
+            draft.donors.add_points(row, points)
+            donor = draft.donors.record(row)
+            self.database.update_donor_points(donor_id, donor['points'])
+            draft.leaderboards.update(row, donor['points'], donor['location'], donor['blood_type'])
+            self._publish(draft)
+
+    def mark_notification(self, notification_id, status):
+        """Update a notification's read status and persist it"""
+        with self._lock:
+            if self._snapshot.inbox.get(notification_id) is None:
+                return
+            self.database.update_notification_status(notification_id, status)
+            draft = _Draft(self._snapshot)
+            draft.inbox.mark(notification_id, status)
+            self._publish(draft)
+
+    def _publish(self, draft):
+        """Make a draft the current snapshot; call with the lock held"""
+        self._snapshot = draft.publish()
+        _, first, end, rows = self._donor_changes
+        rows.extend(draft.changed_rows)
+        end += len(draft.changed_rows)
+        if len(rows) > 2 * DONOR_CHANGES_KEPT:
+            # A new list, since callers may still be slicing the old one
+            first = end - DONOR_CHANGES_KEPT
+            rows = rows[-DONOR_CHANGES_KEPT:]
+        self._donor_changes = (self._snapshot, first, end, rows)
+
+    def _load(self, draft, marks):
+        db = self.database
+        # Donors come in batches so a bulk import never sits in memory twice over.
+        # Rows already known were changed since, e.g. by a re-import
+        while True:
+            batch = db.load_donors(marks['donors'], limit=SYNC_BATCH_ROWS)
+            if not batch:
+                break
+            new = []
+            for _, donor in batch:
+                row = draft.donors.row_of(donor['id'])
+                if row is None:
+                    new.append(donor)
+                else:
+                    self._update_donor(draft, row, donor)
+            if new:
+                self._load_donors(draft, new)
+            marks['donors'] = batch[-1][0]
+        for rowid, request in db.load_requests(marks['requests']):
+            draft.requests.add(request)
+            draft.metrics.request_added(request['urgency'], request['status'])
+            draft.rollups.request_loaded(request)
+            marks['requests'] = rowid
+        for rowid, response in db.load_responses(marks['responses']):
+            self._load_response(draft, response)
+            marks['responses'] = rowid
+        for rowid, donation in db.load_donations(marks['donations']):
+            self._load_donation(draft, donation)
+            marks['donations'] = rowid
+        for rowid, notification in db.load_notifications(marks['notifications']):
+            draft.inbox.add(notification)
+            draft.rollups.record('notification', notification['timestamp'])
+            marks['notifications'] = rowid
+        if self.scheduler is None:
+            return self._scheduler_cursor
+        changes, cursor = self.scheduler.status_changes(self._scheduler_cursor)
+        for request_id, status in changes:
+            request = draft.requests.get(request_id)
+            if request is not None and request['status'] != status:
+                self._change_status(draft, request, status)
+        return cursor
+
+    def _load_donors(self, draft, donors):
+        store = draft.donors
+        rows = store.extend(donors)
+        lats, lons = store.column('latitude')[rows], store.column('longitude')[rows]
+        blood_types = [donor['blood_type'] for donor in donors]
+        locations = [donor['location'] for donor in donors]
+        draft.grid.add_many(rows, lats, lons)
+        draft.metrics.donors_added(blood_types, [donor['status'] for donor in donors])
+        draft.leaderboards.update_many(
+            rows.tolist(), store.column('points')[rows].tolist(), locations, blood_types
+        )
+        draft.rollups.donors_added(locations)
+
+    def _update_donor(self, draft, row, donor):
+        """Apply a stored donor's current values to their row and everything indexed on it"""
+        store = draft.donors
+        old = store.record(row)
+        if not store.update(row, donor):
+            return
+        new = store.record(row)
+        draft.metrics.donor_status_changed(old['status'], new['status'])
+        draft.metrics.donor_blood_type_changed(old['blood_type'], new['blood_type'])
+        if (old['latitude'], old['longitude']) != (new['latitude'], new['longitude']):
+            draft.grid.add(row, new['latitude'], new['longitude'])
+        if old['location'] != new['location']:
+            draft.rollups.donor_moved(old['location'], new['location'])
+        if any(old[field] != new[field] for field in ('points', 'location', 'blood_type')):
+            draft.leaderboards.remove(row, old['location'], old['blood_type'])
+            draft.leaderboards.update(row, new['points'], new['location'], new['blood_type'])
+        if any(old[field] != new[field] for field in MATCHING_FIELDS):
+            draft.changed_rows.append(row)
+
+    def _load_response(self, draft, response):
+        """Attach a donor's response to its request and count it for analytics"""
+        request = draft.requests.get(response['request_id'])
+        if request is not None:
+            draft.requests.replace(dict(request, responses=request['responses'] + [response]))
+            draft.rollups.record_response(request['created_at'], response)
+
+    def _load_donation(self, draft, donation):
+        """Count a donation and record it on the donor, whom the engine then defers from matching"""
+        draft.metrics.donation_added()
+        draft.rollups.record('donation', donation['donated_at'])
+        row = draft.donors.row_of(donation['donor_id'])
+        if row is not None and to_epoch(donation['donated_at']) > draft.donors.column('last_donation')[row]:
+            draft.donors.set_last_donation(row, donation['donated_at'])
+            draft.changed_rows.append(row)
+
+    def _change_status(self, draft, request, status):
+        draft.metrics.request_status_changed(request['urgency'], request['status'], status)
+        draft.requests.replace(dict(request, status=status))